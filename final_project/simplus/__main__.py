@@ -3,17 +3,19 @@ import pickle
 import smtplib
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QTreeWidgetItem,
-    QComboBox, QFileDialog, QInputDialog)
+    QComboBox, QFileDialog, QInputDialog, QPushButton, QProgressBar,
+    QMessageBox)
 from PyQt5.QtGui import QIcon
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from simplus_ui import Ui_MainWindow
-from generate_tree import GenerateTree
-from importlib import import_module
-from config import model_dict
+from model_registry import registry
+from base_simulation import join_chunks
+from simulation_worker import SimulationWorker
+import result_io
 from functools import partial
 from collections import namedtuple
 from mplwidget import *
-from numpy import genfromtxt
+from csv_loader import load_overlay
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
@@ -22,8 +24,9 @@ class SimplusGUI(QMainWindow):
     def __init__(self):
         super(SimplusGUI, self).__init__()
 
-        # This keeps track of the parameters for different models
-        self.parameter_tree = GenerateTree()
+        # This keeps track of the models and their parameters. Models are
+        # only loaded once they're selected.
+        self.models = registry
 
         # Set up the user interface generated by Qt Designer
         self.ui = Ui_MainWindow()
@@ -44,6 +47,24 @@ class SimplusGUI(QMainWindow):
             self.ui.NumericalModelgraphicsView, self)
         self.ui.NumericalModelPlotLayout.addWidget(self.navi_toolbar4)
 
+        # The cancel button and progress bar for background numerical
+        # runs are added by hand as well
+        self.pushButton_CancelNumerical = QPushButton("Cancel", self)
+        self.pushButton_CancelNumerical.setEnabled(False)
+        self.ui.horizontalLayout_8.insertWidget(
+            1, self.pushButton_CancelNumerical)
+        self.pushButton_RefineNumerical = QPushButton("Refine", self)
+        self.pushButton_RefineNumerical.setEnabled(False)
+        self.ui.horizontalLayout_8.insertWidget(
+            2, self.pushButton_RefineNumerical)
+        self.progressBarNumerical = QProgressBar(self)
+        self.progressBarNumerical.setValue(0)
+        self.ui.verticalLayout.addWidget(self.progressBarNumerical)
+        self.numerical_worker = None
+        # What's needed to add trajectories to the last Monte Carlo run:
+        # (module name, class name, parameters, statistics)
+        self.monte_carlo_run = None
+
         # Populate the comboBox's with available models from config
         self.populate_combo_boxes()
 
@@ -66,6 +87,10 @@ class SimplusGUI(QMainWindow):
             self.onNumericalRunClicked)
         self.ui.pushButton_RunAnalytical.clicked.connect(
             self.onAnalyticalRunClicked)
+        self.pushButton_CancelNumerical.clicked.connect(
+            self.onNumericalCancelClicked)
+        self.pushButton_RefineNumerical.clicked.connect(
+            self.onNumericalRefineClicked)
         self.ui.showLegendNumerical.clicked.connect(
             partial(self.show_legend, "Numerical"))
         self.ui.showLegendAnalytical.clicked.connect(
@@ -89,6 +114,8 @@ class SimplusGUI(QMainWindow):
         # to save it to file.
         self.numerical_data = [0, 0]
         self.analytical_data = [0, 0]
+        # The full state history of the last numerical run, if kept
+        self.numerical_states = None
 
         # Flags determining whether plot legends are displayed or not
         self.show_numerical_legend = False
@@ -104,9 +131,9 @@ class SimplusGUI(QMainWindow):
         self.ui.actionCSVAnalytical.triggered.connect(
             partial(self.load_csv, "Analytical"))
         self.ui.actionPklNumerical.triggered.connect(
-            partial(self.load_pkl, "Numerical"))
+            partial(self.load_data, "Numerical"))
         self.ui.actionPklAnalytical.triggered.connect(
-            partial(self.load_pkl, "Analytical"))
+            partial(self.load_data, "Analytical"))
 
         # Attributes pertaining to email notification
         self.email_toaddr = "none"
@@ -119,15 +146,20 @@ class SimplusGUI(QMainWindow):
         if ok:
             self.email_toaddr = text
 
-    def load_pkl(self, tab):
+    def load_data(self, tab):
         '''
-        This loads and plots pickled data, assuming that it is in
-        the correct format.
+        This loads and plots saved simulation data. .simplus files are
+        memory mapped rather than read in one go. Old pickled (.pkl) files
+        can still be opened, but only load those from people you trust.
         '''
-        name, _ = QFileDialog.getOpenFileName(self, "Open File")
+        name, _ = QFileDialog.getOpenFileName(
+            self, "Open File", "", "Simulation data (*.simplus *.pkl)")
         try:
-            data = pickle.load(open(name, "rb"))["data"]
-        except KeyError:
+            if name.endswith(".pkl"):
+                data = pickle.load(open(name, "rb"))["data"]
+            else:
+                _, data, _ = result_io.load(name)
+        except (KeyError, ValueError):
             # Wrong format
             return
         except FileNotFoundError:
@@ -141,12 +173,13 @@ class SimplusGUI(QMainWindow):
         '''
         Our data is saved in csv format. So it's convenient to be able
         to load in a csv file and overlay it with the simulation, which
-        is what this method does.
+        is what this method does. Raw 0/1 shot logs are binned into
+        probabilities with error bars as they are read.
         '''
         name, _ = QFileDialog.getOpenFileName(self, "Open File")
         try:
-            data = genfromtxt(name, delimiter=",").transpose()
-        except FileNotFoundError:
+            data = load_overlay(name)
+        except (FileNotFoundError, ValueError):
             return
         if tab == "Numerical":
             self.numericalplot.append_csv(data)
@@ -155,38 +188,36 @@ class SimplusGUI(QMainWindow):
 
     def save_data(self, tab):
         '''Save simulation data.'''
+        states = None
         if tab == "Numerical":
             data = self.numerical_data
+            states = self.numerical_states
             model_name = str(self.ui.comboBox_ModelNumerical.currentText())
             params = self.current_settings("Numerical", model_name)
         else:
             data = self.analytical_data
             model_name = str(self.ui.comboBox_ModelAnalytical.currentText())
             params = self.current_settings("Analytical", model_name)
-        d = {"params": params, "data": data}
+        if type(data[0]) is int:
+            # Nothing has been run yet
+            return
         name, _ = QFileDialog.getSaveFileName(self, "Save File")
-        pickle.dump(d, open(name + ".pkl", "wb"))
+        if not name:
+            return
+        if not name.endswith(".simplus"):
+            name += ".simplus"
+        result_io.save(name, data, params, states)
 
     def show_legend(self, tab):
         '''Toggle the simulation legends ON/OFF.'''
         if tab == "Numerical":
-            if self.show_numerical_legend:
-                self.show_numerical_legend = False
-                self.numericalplot.update_figure(self.numerical_data,
-                                                 Legend=False)
-            else:
-                self.show_numerical_legend = True
-                self.numericalplot.update_figure(self.numerical_data,
-                                                 Legend=True)
+            self.show_numerical_legend = not self.show_numerical_legend
+            self.numericalplot.set_legend(self.show_numerical_legend)
+            self.numericalplot.draw()
         else:
-            if self.show_analytical_legend:
-                self.show_analytical_legend = False
-                self.analyticalplot.update_figure(self.analytical_data,
-                                                  Legend=False)
-            else:
-                self.show_analytical_legend = True
-                self.analyticalplot.update_figure(self.analytical_data,
-                                                  Legend=True)
+            self.show_analytical_legend = not self.show_analytical_legend
+            self.analyticalplot.set_legend(self.show_analytical_legend)
+            self.analyticalplot.draw()
 
     def update_model_info(self, tab):
         '''Update model information.'''
@@ -194,17 +225,11 @@ class SimplusGUI(QMainWindow):
             model_name = str(self.ui.comboBox_ModelAnalytical.currentText())
         elif tab == "Numerical":
             model_name = str(self.ui.comboBox_ModelNumerical.currentText())
-        models = model_dict[tab]
-        for module_name, class_name in models:
-            name = getattr(import_module(module_name), class_name)().__str__()
-            if name == model_name:
-                tex = getattr(import_module(module_name),
-                              class_name)().model_info()
-                if tab == "Analytical":
-                    self.mplwidgetinfoanalytic.update_figure(tex)
-                else:
-                    self.mplwidgetinfonumerical.update_figure(tex)
-                break
+        tex = self.models.get(tab, model_name).model.model_info()
+        if tab == "Analytical":
+            self.mplwidgetinfoanalytic.update_figure(tex)
+        else:
+            self.mplwidgetinfonumerical.update_figure(tex)
 
     def populate_parameter_dict(self, tab):
         '''
@@ -215,11 +240,11 @@ class SimplusGUI(QMainWindow):
         if tab == "Analytical":
             model_name = str(self.ui.comboBox_ModelAnalytical.currentText())
             widget = self.ui.treeWidget_Analytical
-            p = self.parameter_tree.values["Analytical"][model_name]
+            p = self.models.parameters("Analytical", model_name)
         if tab == "Numerical":
             model_name = str(self.ui.comboBox_ModelNumerical.currentText())
             widget = self.ui.treeWidget_Numerical
-            p = self.parameter_tree.values["Numerical"][model_name]
+            p = self.models.parameters("Numerical", model_name)
 
         # Connect treeWidget signals
         widget.doubleClicked.connect(partial(self.onDoubleClick, widget))
@@ -325,10 +350,10 @@ class SimplusGUI(QMainWindow):
         tab, model_name = self.get_tab()
 
         if item.parent() is None and item.childCount() == 0:
-            self.parameter_tree.values[tab][model_name][key][0] = selection
+            self.models.parameters(tab, model_name)[key][0] = selection
         else:
             top_level = item.parent().text(0)
-            self.parameter_tree.values[tab][model_name][top_level][key][0] = selection
+            self.models.parameters(tab, model_name)[top_level][key][0] = selection
 
 
     def populate_combo_boxes(self):
@@ -342,11 +367,9 @@ class SimplusGUI(QMainWindow):
         button_dict = {"Analytical": analytical,
                        "Numerical": numerical}
 
-        for key in model_dict.keys():
-            for module_name, class_name in model_dict[key]:
-                name = getattr(import_module(module_name),
-                               class_name)().__str__()
-                button_dict[key].addItem(name)
+        for tab in self.models.tabs():
+            for name in self.models.names(tab):
+                button_dict[tab].addItem(name)
 
     def onDoubleClick(self, widget, index):
         '''
@@ -392,11 +415,11 @@ class SimplusGUI(QMainWindow):
 
         try:
             if has_parent:
-                self.parameter_tree.values[tab][model_name][top_level][key]
-                pitem = self.parameter_tree.values[tab][model_name][top_level]
+                self.models.parameters(tab, model_name)[top_level][key]
+                pitem = self.models.parameters(tab, model_name)[top_level]
             else:
-                self.parameter_tree.values[tab][model_name][key]
-                pitem = self.parameter_tree.values[tab][model_name]
+                self.models.parameters(tab, model_name)[key]
+                pitem = self.models.parameters(tab, model_name)
         except KeyError:
             # The current tab and current item don't match while initially
             # populating the treewidget.
@@ -442,20 +465,110 @@ class SimplusGUI(QMainWindow):
 
     def onNumericalRunClicked(self):
         _, model_name = self.get_tab()
-        models = model_dict["Numerical"]
         solver = str(self.ui.comboBox_EquationSolverType.currentText())
-        for module_name, class_name in models:
-            name = getattr(import_module(module_name), class_name)().__str__()
-            if name == model_name:
-                p = self.current_settings("Numerical", model_name)
-                if solver == "Master Equation Solver":
-                    data = getattr(import_module(module_name),
-                                   class_name)().run_master_equation(**p)
-                else:
-                    data = getattr(import_module(module_name),
-                                   class_name)().run_monte_carlo(**p)
+        # The model itself is only imported by the worker process
+        entry = self.models.get("Numerical", model_name)
+        p = self.current_settings("Numerical", model_name)
+        if solver == "Master Equation Solver":
+            method = "run_master_equation"
+        elif solver == "Auto":
+            method = "run_auto"
+        else:
+            method = "run_monte_carlo"
+        self.start_numerical_worker(entry.module_name, entry.class_name,
+                                    method, p)
 
-        # Send an email when simulation is complete
+    def start_numerical_worker(self, module_name, class_name, method, p):
+        '''
+        Run the simulation in the background, plotting the data as it
+        streams in. The run button is disabled until it's done.
+        '''
+        self.numerical_chunks_received = 0
+        self.numerical_states = None
+        # Fixing the time axis up front lets streamed chunks be blitted
+        # on rather than rescaling the plot every time
+        self.numerical_xlim = (0, p["duration"]) if "duration" in p else None
+        worker = SimulationWorker(module_name, class_name, method, p, self)
+        worker.chunk.connect(self.onNumericalChunk)
+        worker.progress.connect(self.progressBarNumerical.setValue)
+        worker.note.connect(self.ui.statusbar.showMessage)
+        worker.states.connect(self.onNumericalStates)
+        worker.completed.connect(
+            partial(self.onNumericalCompleted, module_name, class_name, p))
+        worker.failed.connect(self.onNumericalFailed)
+        worker.finished.connect(self.onNumericalFinished)
+        self.numerical_worker = worker
+
+        self.progressBarNumerical.setValue(0)
+        self.ui.pushButton_RunNumerical.setEnabled(False)
+        self.pushButton_RefineNumerical.setEnabled(False)
+        self.pushButton_CancelNumerical.setEnabled(True)
+        worker.start()
+
+    def onNumericalChunk(self, chunk):
+        '''Plot the first chunk of a run, then extend the curves.'''
+        if self.numerical_chunks_received:
+            self.numericalplot.extend_figure(chunk)
+        else:
+            self.numericalplot.update_figure(chunk,
+                                             xlim=self.numerical_xlim)
+        self.numerical_chunks_received += 1
+
+    def onNumericalStates(self, states):
+        self.numerical_states = states
+
+    def onNumericalCompleted(self, module_name, class_name, p, chunks,
+                             statistics):
+        self.numerical_data = join_chunks(chunks)
+        if statistics is None:
+            self.monte_carlo_run = None
+        else:
+            p = dict(p)
+            p.pop("statistics", None)
+            self.monte_carlo_run = (module_name, class_name, p, statistics)
+        self.send_email("numerical", module_name)
+
+    def onNumericalRefineClicked(self):
+        '''
+        Add more trajectories to the last Monte Carlo run, keeping its
+        parameters. Only the number of extra trajectories is taken from
+        the current settings.
+        '''
+        if self.monte_carlo_run is None:
+            return
+        module_name, class_name, p, statistics = self.monte_carlo_run
+        p = dict(p)
+        _, model_name = self.get_tab()
+        current = self.current_settings("Numerical", model_name)
+        if "refine trajectories" in current:
+            p["refine trajectories"] = current["refine trajectories"]
+        p["statistics"] = statistics
+        self.start_numerical_worker(module_name, class_name,
+                                    "refine_monte_carlo", p)
+
+    def onNumericalFailed(self, message):
+        QMessageBox.warning(self, "Simulation failed", message)
+
+    def onNumericalCancelClicked(self):
+        if self.numerical_worker is not None:
+            self.numerical_worker.cancel()
+
+    def onNumericalFinished(self):
+        self.numerical_worker = None
+        self.ui.pushButton_RunNumerical.setEnabled(True)
+        self.pushButton_RefineNumerical.setEnabled(
+            self.monte_carlo_run is not None)
+        self.pushButton_CancelNumerical.setEnabled(False)
+
+    def closeEvent(self, event):
+        '''Don't leave a simulation running when the window closes.'''
+        if self.numerical_worker is not None:
+            self.numerical_worker.cancel()
+            self.numerical_worker.wait()
+        super(SimplusGUI, self).closeEvent(event)
+
+    def send_email(self, kind, module_name):
+        '''Send an email when simulation is complete.'''
         if not self.email_toaddr == "none":
             try:
                 fromaddr = "simulation.notification1@gmail.com"
@@ -465,7 +578,8 @@ class SimplusGUI(QMainWindow):
                 msg['To'] = toaddr
                 msg['Subject'] = "Simulation Complete"
 
-                body = "Your numerical {} simulation is complete.".format(module_name)
+                body = "Your {} {} simulation is complete.".format(
+                    kind, module_name)
                 msg.attach(MIMEText(body, 'plain'))
 
                 server = smtplib.SMTP('smtp.gmail.com', 587)
@@ -478,49 +592,21 @@ class SimplusGUI(QMainWindow):
                 # Invalid email address
                 pass
 
-        self.numericalplot.update_figure(data)
-        self.numerical_data = data
-
     def onAnalyticalRunClicked(self):
         _, model_name = self.get_tab()
-        models = model_dict["Analytical"]
-        for module_name, class_name in models:
-            name = getattr(import_module(module_name), class_name)().__str__()
-            if name == model_name:
-                p = self.current_settings("Analytical", model_name)
-                print(p)
-                data = getattr(import_module(module_name),
-                               class_name)().run(**p)
-
-        # Send an email when simulation is complete
-        if not self.email_toaddr == "none":
-            try:
-                fromaddr = "simulation.notification1@gmail.com"
-                toaddr = self.email_toaddr
-                msg = MIMEMultipart()
-                msg['From'] = fromaddr
-                msg['To'] = toaddr
-                msg['Subject'] = "Simulation Complete"
+        entry = self.models.get("Analytical", model_name)
+        p = self.current_settings("Analytical", model_name)
+        print(p)
+        data = entry.model.run_cached("run", **p)
 
-                body = "Your analytical {} simulation is complete.".format(module_name)
-                msg.attach(MIMEText(body, 'plain'))
-
-                server = smtplib.SMTP('smtp.gmail.com', 587)
-                server.starttls()
-                server.login(fromaddr, "simulation")
-                text = msg.as_string()
-                server.sendmail(fromaddr, toaddr, text)
-                server.quit()
-            except smtplib.SMTPRecipientsRefused:
-                # Invalid email address
-                pass
+        self.send_email("analytical", entry.module_name)
 
         self.analyticalplot.update_figure(data)
         self.analytical_data = data
 
     def current_settings(self, tab, model):
         '''Returns a dict of currently selected parameters.'''
-        p = self.parameter_tree.values[tab][model]
+        p = self.models.parameters(tab, model)
         p_current = {}
         for key, val in p.items():
             if type(val) == type:
@@ -1,8 +1,62 @@
+import os
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from numpy import array, asarray, atleast_1d, empty, concatenate
+import result_cache
+
+
+# The result of a parameter sweep. 'axes' is a list of (name, values)
+# pairs, one per swept parameter, and 'data' has the usual
+# [t_list, [label, values, ...], ...] layout, except that the values of
+# every trace, and its error bars if it has any, are stacked to shape
+# (len(values_1), ..., len(values_n)) + the shape at a single point.
+# [label, values] axes of 2D traces are the same for every point and are
+# kept as they are. The labels are those of the first point to finish.
+SweepResult = namedtuple("SweepResult", ["axes", "data"])
+
+
+def join_chunks(chunks):
+    '''
+    Glue the chunks yielded by BaseSimulation.stream back together into
+    a single [t_list, [label, values], ...] data list. The labels, and the
+    [label, values] axes of 2D traces, are taken from the last chunk, which
+    may report on the whole run. Single numbers (what models with nothing
+    to simulate return) are treated as one point long arrays.
+    '''
+    chunks = list(chunks)
+    data = [concatenate([atleast_1d(c[0]) for c in chunks])]
+    for i, trace in enumerate(chunks[-1][1:], 1):
+        # Everything after the label (values, error bars) runs along t
+        joined = [trace[0]]
+        for j, part in enumerate(trace[1:], 1):
+            if type(part) in [list, tuple]:
+                joined.append(part)
+            else:
+                joined.append(concatenate([atleast_1d(c[i][j])
+                                           for c in chunks], axis=-1))
+        data.append(joined)
+    return data
+
+
+def _run_point(cls, solver, index, params):
+    '''Run a single sweep point. Lives at module level so it can be
+    pickled and sent off to the process pool.'''
+    model = cls()
+    model.processes = 1
+    return index, model.run_cached(solver, **params)
 
 
 class BaseSimulation:
 
+    # Solvers whose results are random, and so shouldn't be cached
+    uncached_solvers = ("run_monte_carlo", "refine_monte_carlo")
+
+    # How many processes a solver may spread its own work over, None for
+    # one per core. Runs that are already one of many in a process pool
+    # set this to 1 so the machine isn't oversubscribed.
+    processes = None
+
     def __init__(self):
 
         # The simulation name that will be displayed in the GUI
@@ -39,6 +93,225 @@ class BaseSimulation:
         self.parameter_dict = p
         return self.parameter_dict
 
+    def default_settings(self):
+        '''
+        Returns a flat dict of the default parameter values, in the
+        same form the GUI passes them to the solvers.
+        '''
+        settings = {}
+        for key, val in self.parameter_dict.items():
+            if type(val) == dict:
+                for key1, val1 in val.items():
+                    settings[key1] = self._default_value(val1)
+            else:
+                settings[key] = self._default_value(val)
+        return settings
+
+    def parameter_range(self, name):
+        '''
+        Returns the allowed (min, max) range of a parameter, or None if
+        the parameter doesn't have one.
+        '''
+        for key, val in self.parameter_dict.items():
+            if type(val) == dict:
+                if name in val:
+                    return self._range(val[name])
+            elif key == name:
+                return self._range(val)
+        return None
+
+    @staticmethod
+    def _default_value(val):
+        if type(val) == type:
+            return val.value
+        elif type(val) in [list, tuple]:
+            return val[0]
+        return val
+
+    @staticmethod
+    def _range(val):
+        if type(val) == type:
+            return val.range
+        elif type(val) == tuple:
+            return (val[1], val[2])
+        return None
+
+    def iter_sweep(self, solver, axes, processes=None, **kwargs):
+        '''
+        Run 'solver' (e.g. "run_master_equation") on every point of the
+        grid spanned by 'axes', a list of (parameter name, values) pairs.
+        Parameters that aren't swept are taken from kwargs, falling back
+        on the model defaults. The grid is spread over a process pool
+        with one worker per core and (index, params, data) is yielded
+        as each point finishes, so results stream back out of order.
+        '''
+        params = self.default_settings()
+        params.update(kwargs)
+        axes = [(name, asarray(values)) for name, values in axes]
+
+        for name, values in axes:
+            if name not in params:
+                raise KeyError("{} is not a parameter of {}".format(
+                    name, self.name))
+            r = self.parameter_range(name)
+            if r is not None and (values.min() < r[0] or values.max() > r[1]):
+                raise ValueError("{} sweep is outside of its allowed "
+                                 "range {}".format(name, r))
+
+        shape = tuple(len(values) for _, values in axes)
+        if processes is None:
+            processes = os.cpu_count()
+
+        # Get any one-off setup out of the way before the workers start,
+        # so they don't all do it at once.
+        self.prewarm()
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {}
+            for index in product(*[range(n) for n in shape]):
+                p = dict(params)
+                for (name, values), i in zip(axes, index):
+                    p[name] = values[i].item()
+                futures[pool.submit(_run_point, type(self), solver,
+                                    index, p)] = p
+            for future in as_completed(futures):
+                index, data = future.result()
+                yield index, futures[future], data
+
+    def sweep(self, solver, axes, processes=None, **kwargs):
+        '''
+        Same as iter_sweep, but waits for the whole grid and stacks the
+        traces into arrays. Returns a SweepResult.
+        '''
+        axes = [(name, asarray(values)) for name, values in axes]
+        shape = tuple(len(values) for _, values in axes)
+        data = None
+        for index, _, d in self.iter_sweep(solver, axes, processes,
+                                           **kwargs):
+            if data is None:
+                data = [asarray(d[0])]
+                for trace in d[1:]:
+                    stacked = [trace[0]]
+                    for part in trace[1:]:
+                        if type(part) in [list, tuple]:
+                            # An axis: [label, values]
+                            stacked.append(part)
+                        else:
+                            part = asarray(part)
+                            stacked.append(empty(shape + part.shape,
+                                                 dtype=part.dtype))
+                    data.append(stacked)
+            for stacked, trace in zip(data[1:], d[1:]):
+                for s, part in zip(stacked[1:], trace[1:]):
+                    if type(part) not in [list, tuple]:
+                        s[index] = part
+
+        return SweepResult(axes, data)
+
+    def choose_solver(self, **kwargs):
+        '''
+        Returns the name of the cheapest solver that gets these settings
+        right, along with the reason it was picked. This is what the
+        "run_auto" solver runs. Models with a choice of solvers override
+        it.
+        '''
+        if self.type == "numerical":
+            return "run_master_equation", "it's the only solver"
+        return "run", "it's the only solver"
+
+    def resolve_solver(self, solver, settings):
+        '''The solver to actually run for 'solver', i.e. whichever one
+        choose_solver picks for "run_auto".'''
+        if solver == "run_auto":
+            solver, _ = self.choose_solver(**settings)
+        return solver
+
+    def run_auto(self, **kwargs):
+        '''Run the solver choose_solver picks.'''
+        return getattr(self, self.resolve_solver("run_auto", kwargs))(**kwargs)
+
+    def cache_key(self, solver, settings):
+        '''Result cache key for a run, None if it shouldn't be cached.'''
+        if solver in self.uncached_solvers:
+            return None
+        return result_cache.result_key(self, solver, settings)
+
+    def run_cached(self, solver, **kwargs):
+        '''
+        Run 'solver', returning the stored result if this exact run has
+        been done before.
+        '''
+        solver = self.resolve_solver(solver, kwargs)
+        key = self.cache_key(solver, kwargs)
+        if key is not None:
+            cached = result_cache.load(key)
+            if cached is not None:
+                data, details = cached
+                self.restore_run_details(details)
+                return data
+        data = getattr(self, solver)(**kwargs)
+        if key is not None:
+            result_cache.store(key, data, self.run_details())
+        return data
+
+    def stream(self, solver, **kwargs):
+        '''
+        Run 'solver' and yield the data in time ordered chunks, each with
+        the usual [t_list, [label, values], ...] layout, as soon as they
+        are computed. Models that can integrate piecewise provide an
+        'iter_' + solver generator, anything else yields the whole result
+        in one go. Cached results come back as a single chunk.
+        '''
+        solver = self.resolve_solver(solver, kwargs)
+        key = self.cache_key(solver, kwargs)
+        if key is not None:
+            cached = result_cache.load(key)
+            if cached is not None:
+                data, details = cached
+                self.restore_run_details(details)
+                yield data
+                return
+
+        chunked = getattr(self, "iter_" + solver, None)
+        if chunked is None:
+            chunks = [getattr(self, solver)(**kwargs)]
+            yield chunks[0]
+        else:
+            chunks = []
+            for chunk in chunked(**kwargs):
+                chunks.append(chunk)
+                yield chunk
+
+        if key is not None:
+            result_cache.store(key, join_chunks(chunks), self.run_details())
+
+    def run_details(self):
+        '''
+        What the last run left on the model besides its data (e.g.
+        self.states), as a dict of arrays. The result cache stores these
+        with the data and hands them back to restore_run_details on a hit,
+        so they always belong to the run that was asked for.
+        '''
+        return {}
+
+    def restore_run_details(self, details):
+        '''Set the model up as run_details found it.'''
+        self.states = []
+
+    def state_history(self, **kwargs):
+        '''
+        The density matrix at every time step of the last run, as one
+        array, if it was run with "state history" set to "full" and the
+        solver kept them. None otherwise.
+        '''
+        states = getattr(self, "states", None)
+        if kwargs.get("state history") != "full" or not states:
+            return None
+        if not all(hasattr(ρ, "full") for ρ in states):
+            # This solver only keeps the electronic ρ elements
+            return None
+        return array([ρ.full() for ρ in states])
+
     def get_type(self):
         '''
         Returns the 'type' of simulation, which corresponds to the
@@ -57,6 +330,10 @@ class BaseSimulation:
     def model_info(self):
         return self.model_information
 
+    def prewarm(self):
+        '''Do any expensive one-off setup, e.g. compiling code.'''
+        pass
+
     def run_monte_carlo(self, **kwargs):
         '''This is where we'll implement quantum jump solver.'''
         return [0, ["", 0]]
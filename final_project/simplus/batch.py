@@ -0,0 +1,229 @@
+'''
+Run simplus models from the command line, without the GUI.
+
+Run a single model with some of its parameters changed:
+
+    python simplus/batch.py "Rabi Flop" --tab Numerical \
+        --set "motional dimension=20" --set duration=5 --out results
+
+or every parameter set listed in a JSON (or, with PyYAML installed, YAML)
+job file:
+
+    python simplus/batch.py --jobs jobs.json --out results
+
+A job file looks like
+
+    {"model": "Rabi Flop", "tab": "Numerical",
+     "solver": "run_master_equation",
+     "params": {"duration": 5},
+     "jobs": [{"η": 0.05}, {"η": 0.1}, {"η": 0.2}]}
+
+where "params" applies to every job and each entry of "jobs" is one run.
+Anything given with --set on the command line overrides both. Parameters
+that aren't given keep the model defaults.
+
+The jobs are spread over a process pool and every result is written as
+a .simplus file (see result_io.py) holding the data along with the full
+set of parameters it was run with, and the state history for runs with
+"state history" set to "full". Results already in the result cache
+aren't recomputed. Nothing here imports PyQt5, so this runs fine on
+machines without a display.
+'''
+import os
+import sys
+import json
+import time
+import numbers
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from model_registry import registry
+import result_io
+
+
+def parse_value(text):
+    '''Command line values are JSON if they parse as JSON, else strings.'''
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_overrides(settings):
+    '''Turn a list of "name=value" strings into a dict.'''
+    overrides = {}
+    for setting in settings:
+        name, sep, value = setting.partition("=")
+        if not sep:
+            raise ValueError("expected name=value, got {!r}".format(setting))
+        overrides[name.strip()] = parse_value(value.strip())
+    return overrides
+
+
+def read_job_file(path):
+    '''Read a JSON or YAML job file into a dict.'''
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("PyYAML is needed to read {}".format(path))
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def find_model(name, tab=None):
+    '''The registry entry of the model called name.'''
+    tabs = [tab] if tab is not None else registry.tabs()
+    entries = []
+    for t in tabs:
+        if name in registry.names(t):
+            entries.append(registry.get(t, name))
+    if not entries:
+        raise KeyError("no model called {!r}".format(name))
+    if len(entries) > 1:
+        raise KeyError("{!r} is in more than one tab ({}), pick one with "
+                       "--tab".format(name, ", ".join(e.tab for e in
+                                                     entries)))
+    return entries[0]
+
+
+def job_settings(model, overrides):
+    '''The model defaults with overrides applied, checked against the
+    model's parameters and their allowed ranges.'''
+    settings = model.default_settings()
+    for name, value in overrides.items():
+        if name not in settings:
+            raise KeyError("{} is not a parameter of {}".format(name,
+                                                                model.name))
+        r = model.parameter_range(name)
+        if r is not None and not isinstance(value, numbers.Real):
+            raise ValueError("{} = {!r} has to be a number".format(name,
+                                                                   value))
+        if r is not None and not r[0] <= value <= r[1]:
+            raise ValueError("{} = {} is outside of its allowed range "
+                             "{}".format(name, value, r))
+        settings[name] = value
+    return settings
+
+
+def _run_job(cls, solver, index, params, processes=None):
+    '''Run one job. Lives at module level so the process pool can pickle
+    it.'''
+    start = time.perf_counter()
+    model = cls()
+    model.processes = processes
+    data = model.run_cached(solver, **params)
+    return (index, data, model.state_history(**params),
+            time.perf_counter() - start)
+
+
+def run_jobs(entry, solver, jobs, out_dir, processes=None):
+    '''
+    Run every settings dict in jobs with solver, writing the results to
+    out_dir as job_0000.simplus, job_0001.simplus, ... Returns the number
+    of jobs that failed.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    model = entry.model
+    cls = type(model)
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(1, min(processes, len(jobs)))
+
+    def finished(index, data, states, seconds):
+        path = os.path.join(out_dir, "job_{:04d}.simplus".format(index))
+        result_io.save(path, data, params=jobs[index], states=states)
+        print("job {}/{} done in {:.2f} s -> {}".format(
+            index + 1, len(jobs), seconds, path))
+        if solver == "run_auto":
+            # Same note the GUI shows in its status bar
+            print("  Using {}: {}".format(*model.choose_solver(
+                **jobs[index])))
+
+    failed = 0
+    if processes == 1:
+        for index, params in enumerate(jobs):
+            try:
+                finished(*_run_job(cls, solver, index, params))
+            except Exception:
+                failed += 1
+                print("job {} failed:\n{}".format(index + 1,
+                                                  traceback.format_exc()),
+                      file=sys.stderr)
+        return failed
+
+    # Get any one-off setup out of the way before the workers start, so
+    # they don't all do it at once.
+    model.prewarm()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        # The jobs already use every core between them
+        futures = {pool.submit(_run_job, cls, solver, index, params, 1):
+                   index
+                   for index, params in enumerate(jobs)}
+        for future in as_completed(futures):
+            try:
+                finished(*future.result())
+            except Exception:
+                failed += 1
+                print("job {} failed:\n{}".format(futures[future] + 1,
+                                                  traceback.format_exc()),
+                      file=sys.stderr)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run simplus models without the GUI.")
+    parser.add_argument("model", nargs="?",
+                        help="model name, as shown in the GUI")
+    parser.add_argument("--tab", choices=registry.tabs(),
+                        help="tab the model is in, if the name is ambiguous")
+    parser.add_argument("--solver",
+                        help="solver method, run_auto picks the cheapest "
+                             "(default: run_master_equation for numerical "
+                             "models, run otherwise)")
+    parser.add_argument("--set", action="append", default=[],
+                        metavar="NAME=VALUE",
+                        help="change a parameter, can be repeated")
+    parser.add_argument("--jobs", metavar="FILE",
+                        help="JSON or YAML file listing parameter sets")
+    parser.add_argument("--processes", type=int,
+                        help="number of worker processes (default: one per "
+                             "core)")
+    parser.add_argument("--out", default="simplus_results",
+                        help="directory to write the results to")
+    args = parser.parse_args(argv)
+
+    spec = read_job_file(args.jobs) if args.jobs else {}
+    name = args.model or spec.get("model")
+    if name is None:
+        parser.error("give a model name or a job file")
+    try:
+        entry = find_model(name, args.tab or spec.get("tab"))
+        solver = args.solver or spec.get("solver")
+        if solver is None:
+            solver = ("run_master_equation" if entry.tab == "Numerical"
+                      else "run")
+        if not callable(getattr(entry.model, solver, None)):
+            raise KeyError("{} has no solver {}".format(name, solver))
+
+        common = dict(spec.get("params", {}))
+        overrides = parse_overrides(args.set)
+        jobs = []
+        for job in spec.get("jobs", [{}]):
+            params = dict(common)
+            params.update(job)
+            params.update(overrides)
+            jobs.append(job_settings(entry.model, params))
+    except (KeyError, ValueError) as e:
+        parser.error(e.args[0])
+
+    print("running {} job(s) of {} {} with {}".format(
+        len(jobs), entry.tab, name, solver))
+    failed = run_jobs(entry, solver, jobs, args.out, args.processes)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
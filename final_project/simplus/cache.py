@@ -0,0 +1,66 @@
+'''Small caches shared by the simulation models, and a helper for the
+ones kept on disk.'''
+import os
+from collections import OrderedDict
+
+
+def atomic_write(path, contents):
+    '''
+    Write the bytes 'contents' to path. They go to a temporary file first,
+    which then replaces path, so other processes never see a half written
+    file.
+    '''
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(contents)
+    os.replace(tmp, path)
+
+
+class LRUCache:
+    '''
+    A least recently used cache with a cap on the total size of the
+    cached values. 'sizeof' returns the size of a value in bytes.
+    Once the cap is exceeded the least recently used entries are
+    thrown out, although the newest entry is always kept.
+    '''
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, build):
+        '''
+        Returns the value stored under key, calling build() to create
+        it on a miss.
+        '''
+        try:
+            value, _ = self._items[key]
+            self._items.move_to_end(key)
+            return value
+        except KeyError:
+            pass
+        value = build()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+        size = self.sizeof(value)
+        self._items[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self._items) > 1:
+            _, (_, size) = self._items.popitem(last=False)
+            self.nbytes -= size
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
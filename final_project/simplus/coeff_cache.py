@@ -0,0 +1,92 @@
+'''
+Persistent cache for the code qutip generates from string coefficients.
+
+qutip writes the generated coefficient code to a throwaway file with a
+pid/time stamped name, compiles it, imports it and deletes it again, so
+every new process (and every worker in a pool) pays for the compilation
+again. Here the generated code is written once to a file named after its
+hash in 'cache_dir' and imported from there. The code only depends on the
+coefficient strings and the names of the args, not on the operators or
+the arg values, so every run with the same term structure shares it.
+With cython the compiled extension lives in pyximport's build directory
+and is reused as long as the source file doesn't change.
+'''
+import os
+import sys
+import hashlib
+from importlib import import_module
+import qutip.qobjevo as qobjevo
+import qutip.qobjevo_codegen as codegen
+from cache import atomic_write
+
+cache_dir = os.environ.get("SIMPLUS_COEFF_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".simplus",
+                                        "coeff_cache"))
+
+# Coefficient classes that have already been imported in this process,
+# keyed by module name.
+_loaded = {}
+
+
+def _import_cached(code, prefix, obj_name, cythonfile):
+    '''Import 'obj_name' from the cached module holding 'code'.'''
+    name = prefix + hashlib.sha1(code.encode()).hexdigest()[:20]
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+
+    ext = ".pyx" if cythonfile else ".py"
+    path = os.path.join(cache_dir, name + ext)
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        atomic_write(path, code.encode())
+    if cache_dir not in sys.path:
+        sys.path.insert(0, cache_dir)
+
+    obj = getattr(import_module(name), obj_name)
+    _loaded[name] = obj
+    return obj
+
+
+# qutip deletes whatever file the compile functions hand back, so we
+# give it nothing to delete and keep the cached source to ourselves.
+_NO_FILE = ""
+
+
+def _compiled_coeffs(ops, args, dyn_args, tlist):
+    code = codegen._make_code_4_cimport(ops, args, dyn_args, tlist)
+    coeff_obj = _import_cached(code, "cqobjevo_compiled_coeff_",
+                               "CompiledStrCoeff", True)
+    return coeff_obj(ops, args, tlist, dyn_args), code, _NO_FILE
+
+
+def _compiled_coeffs_python(ops, args, dyn_args, tlist):
+    code = codegen._make_code_4_python_import(ops, args, dyn_args, tlist)
+    coeff_obj = _import_cached(code, "qobjevo_compiled_coeff_",
+                               "_UnitedStrCaller", False)
+    return coeff_obj, code, _NO_FILE
+
+
+def install():
+    '''Route qutip's coefficient compilation through the cache.'''
+    qobjevo._compiled_coeffs = _compiled_coeffs
+    qobjevo._compiled_coeffs_python = _compiled_coeffs_python
+
+
+def prewarm(hamiltonians):
+    '''
+    Compile the coefficients of a list of (H, args) Hamiltonians ahead of
+    time, e.g. at startup or before starting a process pool, so that the
+    first run doesn't have to.
+    '''
+    install()
+    for H, args in hamiltonians:
+        H_td = qobjevo.QobjEvo(H, args=args)
+        H_td.compile()
+
+
+if __name__ == "__main__":
+    from rabi_flop_numerical import RabiFlopNumerical
+    RabiFlopNumerical().prewarm()
+    print("Coefficient cache is in {}".format(cache_dir))
@@ -3,10 +3,13 @@
 # lower case) in the GUI. The dictionary values are tuples, where the
 # first element is the simulation file name (without the '.py') and
 # the second element is the name of the class containing the simulation
-# object.
+# object. An optional third element gives the name the model is shown
+# under in the GUI, which saves importing the model just to find it out.
 
 model_dict = dict()
-model_dict["Analytical"] = [("rabi_flop_analytic", "RabiFlopAnalytic"),
-                            ("ms_analytic", "MSAnalytic")]
-model_dict["Numerical"] = [("rabi_flop_numerical", "RabiFlopNumerical"),
-                           ("ms_numerical", "MSNumerical")]
+model_dict["Analytical"] = [("rabi_flop_analytic", "RabiFlopAnalytic",
+                             "Rabi Flop"),
+                            ("ms_analytic", "MSAnalytic", "Molmer Sorensen")]
+model_dict["Numerical"] = [("rabi_flop_numerical", "RabiFlopNumerical",
+                            "Rabi Flop"),
+                           ("ms_numerical", "MSNumerical", "Molmer Sorensen")]
@@ -0,0 +1,122 @@
+'''
+Fast loading of (possibly huge) csv files of experimental data.
+
+The file is read in blocks of bytes, which numpy parses straight into
+floats, so memory use is bounded by the block size rather than the file
+size. Raw shot logs, i.e. a time column and a 0/1 outcome column, are
+aggregated into per-time probabilities with binomial error bars in the
+same single pass.
+'''
+import warnings
+from itertools import chain
+from numpy import (fromstring, concatenate, unique, bincount, floor,
+                   sqrt, array, argsort, isin, float64, int64)
+
+
+def _parse(block, ncols):
+    '''Parse a block of complete csv lines into an (n, ncols) array.'''
+    # Blank lines would otherwise turn into empty fields
+    block = b",".join(line for line in block.replace(b"\r", b"").split(b"\n")
+                      if line.strip())
+    with warnings.catch_warnings():
+        # numpy only warns when it hits something that isn't a number
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = fromstring(block, sep=",")
+        except DeprecationWarning:
+            raise ValueError("csv file contains non numeric values")
+    if values.size % ncols:
+        raise ValueError("csv rows don't all have {} columns".format(ncols))
+    return values.reshape(-1, ncols)
+
+
+def iter_csv_chunks(path, block_bytes=2**24):
+    '''
+    Yield the rows of a numeric csv file as (n, ncols) arrays, a block
+    at a time. A non numeric first line is taken to be a header.
+    '''
+    with open(path, "rb") as f:
+        first = f.readline()
+        ncols = first.count(b",") + 1
+        try:
+            _parse(first, ncols)
+            leftover = first
+        except ValueError:
+            # Header line
+            leftover = b""
+
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            block = leftover + block
+            # Only parse up to the last complete line
+            end = block.rfind(b"\n") + 1
+            leftover = block[end:]
+            if end:
+                rows = _parse(block[:end], ncols)
+                if len(rows):
+                    yield rows
+        if leftover.strip():
+            yield _parse(leftover, ncols)
+
+
+def read_csv(path):
+    '''Read a whole csv file, returning its columns (like genfromtxt().T).'''
+    chunks = list(iter_csv_chunks(path))
+    if not chunks:
+        return array([[], []])
+    return concatenate(chunks).transpose()
+
+
+def is_shot_data(rows):
+    '''True if the second column only holds 0/1 outcomes.'''
+    return rows.shape[1] == 2 and isin(rows[:, 1], (0, 1)).all()
+
+
+def aggregate_shots(chunks, bin_width=0):
+    '''
+    Turn (time, outcome) rows into per-time-bin probabilities in a single
+    pass. With bin_width 0 every distinct time is its own bin. Returns the
+    mean time, probability, binomial standard error and number of shots of
+    every bin.
+    '''
+    # bin -> [sum of times, shots, successes]
+    bins = {}
+    for rows in chunks:
+        t, outcome = rows[:, 0], rows[:, 1]
+        if bin_width > 0:
+            keys = floor(t / bin_width).astype(int64)
+        else:
+            keys = t
+        keys, inverse = unique(keys, return_inverse=True)
+        t_sum = bincount(inverse, weights=t)
+        n = bincount(inverse)
+        k = bincount(inverse, weights=outcome)
+        for key, ts, nn, kk in zip(keys.tolist(), t_sum, n, k):
+            b = bins.setdefault(key, [0., 0, 0.])
+            b[0] += ts
+            b[1] += nn
+            b[2] += kk
+
+    stats = array(list(bins.values()), dtype=float64).reshape(-1, 3)
+    stats = stats[argsort(stats[:, 0] / stats[:, 1])]
+    n = stats[:, 1]
+    p = stats[:, 2] / n
+    return stats[:, 0] / n, p, sqrt(p * (1 - p) / n), n
+
+
+def load_overlay(path, bin_width=0):
+    '''
+    Load a csv file to overlay on a simulation. Shot logs come back
+    aggregated as [t, p, error], anything else as its columns.
+    '''
+    chunks = iter_csv_chunks(path)
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return array([[], []])
+    if is_shot_data(first):
+        t, p, err, _ = aggregate_shots(chain([first], chunks), bin_width)
+        return array([t, p, err])
+    return concatenate([first] + list(chunks)).transpose()
@@ -1,21 +1,20 @@
-from importlib import import_module
-from config import model_dict
+from model_registry import registry
 
 
 class GenerateTree:
+    '''
+    The parameters of every model, by tab and model name. This loads all
+    of the models; the GUI goes through the registry, which only loads
+    the ones that get selected.
+    '''
 
     def __init__(self):
         parameters = dict()
 
-        for key in model_dict.keys():
-            parameters[key] = dict()
-            for val in model_dict[key]:
-                for module_name, class_name in model_dict[key]:
-                    name = getattr(import_module(module_name),
-                                   class_name)().__str__()
-                    p = getattr(import_module(module_name),
-                                class_name)().get_parameters()
-                    parameters[key][name] = p
+        for tab in registry.tabs():
+            parameters[tab] = dict()
+            for name in registry.names(tab):
+                parameters[tab][name] = registry.parameters(tab, name)
         self.values = parameters
 
 
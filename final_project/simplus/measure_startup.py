@@ -0,0 +1,71 @@
+'''
+Measure how long simplus takes to start, so it can be kept track of.
+
+    python measure_startup.py [number of slowest imports to list]
+
+The GUI is started in a fresh interpreter (offscreen, so no display is
+needed) under python -X importtime. Reported are the time until the
+window has been shown, whether qutip got imported on the way (it
+shouldn't be until a numerical model is run) and the slowest top level
+imports.
+'''
+import os
+import sys
+import time
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP = """
+import sys, time, runpy
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+gui = runpy.run_path("__main__.py", run_name="simplus_gui")["SimplusGUI"]()
+gui.show()
+app.processEvents()
+print(time.perf_counter() - start)
+print("qutip" in sys.modules)
+"""
+
+
+def parse_importtime(lines):
+    '''(cumulative seconds, module) of every top level import.'''
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented further
+        if not name[1:].startswith(" "):
+            try:
+                imports.append((int(cumulative) / 1e6, name.strip()))
+            except ValueError:
+                # The header line
+                pass
+    return sorted(imports, reverse=True)
+
+
+def measure(top=15):
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["PYTHONPATH"] = here + os.pathsep + env.get("PYTHONPATH", "")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                           STARTUP], cwd=here, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+    total = time.perf_counter() - start
+    window, qutip = proc.stdout.split()[-2:]
+
+    print("interpreter start to window shown: {:.3f} s".format(total))
+    print("window set up (imports included):  {:.3f} s".format(
+        float(window)))
+    print("qutip imported: {}".format(qutip))
+    print("\nslowest imports (cumulative):")
+    for seconds, name in parse_importtime(proc.stderr.splitlines())[:top]:
+        print("  {:.3f} s  {}".format(seconds, name))
+
+
+if __name__ == "__main__":
+    measure(*[int(a) for a in sys.argv[1:2]])
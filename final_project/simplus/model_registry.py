@@ -0,0 +1,75 @@
+'''
+Registry of the simulation models listed in config.model_dict.
+
+The registry is built once from the config without importing anything:
+a model's module is only imported, and the model only instantiated, the
+first time it's actually needed (its parameters are shown, its info is
+drawn or it's run), and that one instance is kept from then on. So the
+start up time doesn't grow with the number of models.
+'''
+from importlib import import_module
+from config import model_dict
+
+
+class ModelEntry:
+    '''A model in the registry, loaded on first use.'''
+
+    def __init__(self, tab, module_name, class_name, name=None):
+        self.tab = tab
+        self.module_name = module_name
+        self.class_name = class_name
+        self._name = name
+        self._model = None
+        self._parameters = None
+
+    @property
+    def cls(self):
+        return getattr(import_module(self.module_name), self.class_name)
+
+    @property
+    def model(self):
+        '''The one instance of the model.'''
+        if self._model is None:
+            self._model = self.cls()
+        return self._model
+
+    @property
+    def name(self):
+        # Configs that don't give the name need the model to find it
+        if self._name is None:
+            self._name = str(self.model)
+        return self._name
+
+    @property
+    def parameters(self):
+        '''The model's parameter dict, which the GUI edits in place.'''
+        if self._parameters is None:
+            self._parameters = self.model.get_parameters()
+        return self._parameters
+
+
+class ModelRegistry:
+    '''Models by tab and display name.'''
+
+    def __init__(self, models=model_dict):
+        self._entries = {}
+        for tab, entries in models.items():
+            self._entries[tab] = [ModelEntry(tab, *e) for e in entries]
+
+    def tabs(self):
+        return list(self._entries)
+
+    def names(self, tab):
+        return [entry.name for entry in self._entries[tab]]
+
+    def get(self, tab, name):
+        for entry in self._entries[tab]:
+            if entry.name == name:
+                return entry
+        raise KeyError("no {} model called {!r}".format(tab, name))
+
+    def parameters(self, tab, name):
+        return self.get(tab, name).parameters
+
+
+registry = ModelRegistry()
@@ -1,25 +1,32 @@
 from __future__ import unicode_literals
 from PyQt5 import QtCore, QtWidgets
-from numpy import arange, sin, pi
+from numpy import (arange, sin, pi, ndim, concatenate, atleast_1d,
+                   searchsorted, linspace, unique, minimum, maximum, repeat,
+                   stack)
 import matplotlib as mpl
 # Make sure that we are using QT5, this isn't currently necessary
 # mpl.use('Qt5Agg')
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
+from matplotlib.offsetbox import OffsetImage, AnnotationBbox
+from tex_render import render, plot_label
 
-# Enable use of amsmath latex package for model information tab
-mpl.rcParams['text.usetex'] = True
-mpl.rcParams['text.latex.preamble'] = [r'\usepackage{amsmath}']
+# Plot labels go through mathtext, which is a lot quicker than LaTeX. The
+# model information is rendered with LaTeX once and cached as an image.
+mpl.rcParams['text.usetex'] = False
 
 
 class MyMplCanvas(FigureCanvas):
     '''Ultimately, this is a QWidget (as well as a FigureCanvasAgg, etc.).'''
 
+    # Widgets that only draw once they're shown can leave making their
+    # axes until then
+    defer_axes = False
+
     def __init__(self, parent=None, width=5, height=4, dpi=100, tight_layout=True):
         fig = Figure(figsize=(width, height), dpi=dpi)
         self.fig = fig
-        self.axes = fig.add_subplot(111)
+        self.axes = None if self.defer_axes else fig.add_subplot(111)
 
         self.compute_initial_figure()
 
@@ -38,17 +45,48 @@ class MyMplCanvas(FigureCanvas):
 class MplWidgetInfo(MyMplCanvas):
     '''Display information about the selected model.'''
 
+    defer_axes = True
+
     def __init__(self, *args, **kwargs):
         MyMplCanvas.__init__(self, *args, **kwargs)
 
     def compute_initial_figure(self):
-        self.axes.axis("off")
-        self.axes.annotate("", (0, 0.95))
+        self.model_info = None
+        self.pending_info = None
 
     def update_figure(self, model_info):
+        '''
+        Show the model information. Rendering it waits until the widget
+        is actually shown, i.e. its tab is selected.
+        '''
+        self.pending_info = model_info
+        if self.isVisible():
+            self.draw_model_info()
+
+    def showEvent(self, event):
+        MyMplCanvas.showEvent(self, event)
+        if self.pending_info is not None:
+            self.draw_model_info()
+
+    def draw_model_info(self):
+        '''
+        Draw the pending model information. It's rendered to an image,
+        cached by its source, which is drawn at its native resolution.
+        '''
+        model_info, self.pending_info = self.pending_info, None
+        if model_info == self.model_info:
+            return
+        self.model_info = model_info
+        if self.axes is None:
+            self.axes = self.fig.add_subplot(111)
         self.axes.clear()
         self.axes.axis("off")
-        self.axes.annotate(model_info, (0, 1))
+        image = OffsetImage(render(model_info, dpi=self.fig.dpi),
+                            dpi_cor=False)
+        self.axes.add_artist(AnnotationBbox(image, (0, 1),
+                                            xycoords="axes fraction",
+                                            box_alignment=(0, 1),
+                                            frameon=False, pad=0))
         # Making sure text fits in visible plot area
         self.fig.subplots_adjust(left=0.1, right=0.9,
                                  bottom=0.1, top=0.75,
@@ -56,69 +94,308 @@ class MplWidgetInfo(MyMplCanvas):
         self.draw()
 
 
-class MplWidgetAnalytic(MyMplCanvas):
-    """Simple mplWidget implementation."""
-    
+def _view_bins(t, x0, x1, npix):
+    '''
+    Returns the slice of t in view, keeping a point either side so lines
+    run off the edges, and the index where each of npix equal time bins
+    between x0 and x1 starts within it. The bins are None when there are
+    few enough points to draw them all.
+    '''
+    lo = max(searchsorted(t, x0) - 1, 0)
+    hi = min(searchsorted(t, x1, side="right") + 1, len(t))
+    if hi - lo <= 2 * npix:
+        return slice(lo, hi), None
+    t = t[lo:hi]
+    starts = searchsorted(t, linspace(x0, x1, npix + 1)[1:-1])
+    starts = unique(concatenate([[0], starts]))
+    return slice(lo, hi), starts[starts < len(t)]
+
+
+def minmax_decimate(t, y, x0, x1, npix):
+    '''
+    Reduce a trace to what can be seen between x0 and x1 at a width of
+    npix pixels: the min and max of y in every pixel wide time bin, i.e.
+    at most 2*npix points. t has to be sorted.
+    '''
+    view, starts = _view_bins(t, x0, x1, npix)
+    t, y = t[view], y[view]
+    if starts is None:
+        return t, y
+    lows = minimum.reduceat(y, starts)
+    highs = maximum.reduceat(y, starts)
+    return repeat(t[starts], 2), stack([lows, highs], axis=1).ravel()
+
+
+def band_decimate(t, low, high, x0, x1, npix):
+    '''Like minmax_decimate, for the edges of an error band.'''
+    view, starts = _view_bins(t, x0, x1, npix)
+    t, low, high = t[view], low[view], high[view]
+    if starts is None:
+        return t, low, high
+    return (t[starts], minimum.reduceat(low, starts),
+            maximum.reduceat(high, starts))
+
+
+class _Trace:
+    '''A plotted trace: its full resolution data and the artists drawing it.'''
+
+    def __init__(self, t, d, line):
+        self.label = d[0]
+        self.line = line
+        self.band = None
+        self.set_data(t, d)
+
+    def set_data(self, t, d):
+        # Models with nothing to simulate yet return a single number
+        self.t = atleast_1d(t)
+        self.y = atleast_1d(d[1])
+        # An optional third element holds error bars
+        self.err = atleast_1d(d[2]) if len(d) > 2 else None
+
+    def extend(self, t, d):
+        self.t = concatenate([self.t, atleast_1d(t)])
+        self.y = concatenate([self.y, atleast_1d(d[1])])
+        if self.err is not None:
+            self.err = concatenate([self.err, atleast_1d(d[2])])
+
+
+class MplWidgetPlot(MyMplCanvas):
+    '''
+    Line plot of simulation data. The lines are kept between updates and
+    only get the data that is visible at the current zoom, min/max
+    decimated to about two points per pixel, so even very long traces
+    redraw quickly. The full data is kept to re-decimate from whenever
+    the view changes.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        MyMplCanvas.__init__(self, *args, **kwargs)
+        self.mpl_connect("resize_event", self.on_view_changed)
+
     def compute_initial_figure(self):
+        self.traces = []
+        self.overlays = []
+        self.image = None
+        self.data = None
+        self.decimated_view = None
         self.axes.plot([0], [0], linewidth=0)
-        self.axes.tick_params(which="both", direction="in", bottom=True,
-                              top=True, left=True, right=True)
-        self.fig.subplots_adjust(left=0.05, right=0.98,
-                                 bottom=0.05, top=0.95,
-                                 hspace=0.2, wspace=0.2)
-        self.axes.grid(True)
+        self.style_axes()
+        self.axes.callbacks.connect("xlim_changed", self.on_view_changed)
 
-    def update_figure(self, data, Legend=False, append=False):
-        if not append:
-            self.axes.clear()
-        t = data[0]
-        for d in data[1:]:
-            self.axes.plot(t, d[1], label=d[0])
+    def style_axes(self):
         self.axes.tick_params(which="both", direction="in", bottom=True,
                               top=True, left=True, right=True)
         self.fig.subplots_adjust(left=0.05, right=0.98,
                                  bottom=0.05, top=0.95,
                                  hspace=0.2, wspace=0.2)
         self.axes.grid(True)
-        if Legend:
-            self.axes.legend(loc=1)
+
+    def clear_axes(self):
+        self.axes.clear()
+        self.traces = []
+        self.overlays = []
+        self.image = None
+        self.decimated_view = None
+        self.style_axes()
+        # clear() drops the axes callbacks too
+        self.axes.callbacks.connect("xlim_changed", self.on_view_changed)
+
+    def pixel_width(self):
+        return max(int(self.axes.bbox.width), 100)
+
+    def update_figure(self, data, Legend=False, append=False, xlim=None):
+        '''
+        Plot data, fixing the x range to xlim if it's given. Lines already
+        showing traces with the same labels are reused rather than
+        replotted, and plotting the same data again only updates the
+        legend.
+        '''
+        if data is not self.data or append:
+            t = data[0]
+            traces = data[1:]
+            if append:
+                self.add_traces(t, traces)
+            elif ([d[0] for d in traces] == [tr.label for tr in self.traces]
+                  and all((len(d) > 2) == (tr.err is not None)
+                          for d, tr in zip(traces, self.traces))):
+                for trace, d in zip(self.traces, traces):
+                    trace.set_data(t, d)
+                self.remove_overlays()
+            else:
+                self.clear_axes()
+                self.add_traces(t, traces)
+            self.data = data
+            self.rescale(xlim)
+        self.set_legend(Legend)
         self.draw()
 
+    def add_traces(self, t, traces):
+        for d in traces:
+            line, = self.axes.plot([], [], label=plot_label(d[0]))
+            self.traces.append(_Trace(t, d, line))
+
+    def rescale(self, xlim=None):
+        '''Autoscale the axes to the full data and re-decimate.'''
+        self.axes.set_autoscale_on(True)
+        npix = self.pixel_width()
+        for trace in self.traces:
+            if len(trace.t):
+                # min/max decimation keeps the extremes, so the limits
+                # come out the same as for the full data
+                trace.line.set_data(*minmax_decimate(
+                    trace.t, trace.y, trace.t[0], trace.t[-1], npix))
+        self.axes.relim()
+        for trace in self.traces:
+            if trace.err is not None and len(trace.t):
+                self.axes.update_datalim(
+                    [[trace.t[0], (trace.y - trace.err).min()],
+                     [trace.t[-1], (trace.y + trace.err).max()]])
+        if xlim is not None:
+            self.axes.set_xlim(xlim)
+        self.axes.autoscale_view()
+        self.decimate()
+
+    def decimate(self):
+        '''Give every line just the data needed at the current view.'''
+        x0, x1 = self.axes.get_xlim()
+        npix = self.pixel_width()
+        self.decimated_view = (x0, x1, npix)
+        for trace in self.traces:
+            trace.line.set_data(*minmax_decimate(trace.t, trace.y,
+                                                 x0, x1, npix))
+            if trace.band is not None:
+                trace.band.remove()
+                trace.band = None
+            if trace.err is not None:
+                tb, low, high = band_decimate(trace.t, trace.y - trace.err,
+                                              trace.y + trace.err,
+                                              x0, x1, npix)
+                trace.band = self.axes.fill_between(
+                    tb, low, high, color=trace.line.get_color(),
+                    alpha=0.3, linewidth=0)
+
+    def on_view_changed(self, *args):
+        # Called on zooming, panning and resizing, all of which redraw
+        # afterwards anyway
+        x0, x1 = self.axes.get_xlim()
+        if self.decimated_view != (x0, x1, self.pixel_width()):
+            self.decimate()
+
+    def extend_figure(self, data):
+        '''
+        Append a chunk of streamed data to the curves drawn by the last
+        update_figure call. If the new data fits in the current view only
+        the new segments are drawn and blitted onto the canvas, otherwise
+        the axes are rescaled and redrawn.
+        '''
+        t = atleast_1d(data[0])
+        x0, x1 = self.axes.get_xlim()
+        y0, y1 = sorted(self.axes.get_ylim())
+        fits = self.supports_blit and x0 <= t[0] and t[-1] <= x1
+        starts = []
+        for trace, d in zip(self.traces, data[1:]):
+            starts.append(max(len(trace.t) - 1, 0))
+            trace.extend(t, d)
+            y = atleast_1d(d[1])
+            fits = (fits and trace.err is None and
+                    y0 <= y.min() and y.max() <= y1)
+            if d[0] != trace.label:
+                # The last chunk of a run may add to the labels
+                trace.label = d[0]
+                trace.line.set_label(plot_label(d[0]))
+                fits = False
+        if not fits:
+            if self.axes.get_legend() is not None:
+                self.axes.legend(loc=1)
+            self.rescale(None if self.axes.get_autoscalex_on() else (x0, x1))
+            self.draw()
+            return
+
+        npix = self.pixel_width()
+        for trace, start in zip(self.traces, starts):
+            # Draw on top of what's already on the canvas, starting from
+            # the last point that was drawn
+            trace.line.set_data(*minmax_decimate(
+                trace.t[start:], trace.y[start:], x0, x1, npix))
+            self.axes.draw_artist(trace.line)
+            trace.line.set_data(*minmax_decimate(trace.t, trace.y,
+                                                 x0, x1, npix))
+        legend = self.axes.get_legend()
+        if legend is not None:
+            self.axes.draw_artist(legend)
+        self.blit(self.axes.bbox)
+
+    def set_legend(self, visible):
+        '''Show or hide the legend without touching the lines.'''
+        legend = self.axes.get_legend()
+        if visible and legend is None and self.traces:
+            self.axes.legend(loc=1)
+        elif not visible and legend is not None:
+            legend.remove()
+
+    def remove_overlays(self):
+        for artist in self.overlays:
+            artist.remove()
+        self.overlays = []
+
     def append_csv(self, data):
-        self.axes.plot(data[0], data[1], linewidth=0, marker="o")
+        # Aggregated shot data comes with binomial error bars
+        if len(data) > 2:
+            artist = self.axes.errorbar(data[0], data[1], yerr=data[2],
+                                        linewidth=0, elinewidth=1,
+                                        capsize=2, marker="o")
+            self.overlays.append(artist)
+        else:
+            self.overlays += self.axes.plot(data[0], data[1], linewidth=0,
+                                            marker="o")
         self.draw()
 
 
-class MplWidgetNumerical(MyMplCanvas):
+class MplWidgetAnalytic(MplWidgetPlot):
     """Simple mplWidget implementation."""
 
-    def compute_initial_figure(self):
-        self.axes.plot([0], [0], linewidth=0)
-        self.axes.tick_params(which="both", direction="in", bottom=True,
-                              top=True, left=True, right=True)
-        self.fig.subplots_adjust(left=0.05, right=0.98,
-                                 bottom=0.05, top=0.95,
-                                 hspace=0.2, wspace=0.2)
-        self.axes.grid(True)
-
-    def update_figure(self, data, Legend=False, append=False):
-        if not append:
-            self.axes.clear()
+    def update_figure(self, data, Legend=False, append=False, xlim=None):
         t = data[0]
         for d in data[1:]:
-            self.axes.plot(t, d[1], label=d[0])
-        self.axes.tick_params(which="both", direction="in", bottom=True,
-                              top=True, left=True, right=True)
-        self.fig.subplots_adjust(left=0.05, right=0.98,
-                                 bottom=0.05, top=0.95,
-                                 hspace=0.2, wspace=0.2)
-        self.axes.grid(True)
-        if Legend:
-            self.axes.legend(loc=1)
-        self.draw()
+            if ndim(d[1]) == 2:
+                self.update_heatmap(t, d)
+                self.draw()
+                return
+        MplWidgetPlot.update_figure(self, data, Legend, append, xlim)
 
-    def append_csv(self, data):
-        self.axes.plot(data[0], data[1], linewidth=0, marker="o")
-        self.draw()
+    def update_heatmap(self, t, d):
+        '''
+        Plot a 2D trace, e.g. a chevron map, as an image. The optional
+        third element of the trace holds the y axis label and values.
+        The image is reused if it has the same shape.
+        '''
+        if len(d) > 2:
+            ylabel, y = d[2]
+        else:
+            ylabel, y = "", arange(len(d[1]))
+        extent = [t[0], t[-1], y[0], y[-1]]
+        if self.image is not None and self.image.get_array().shape == \
+                d[1].shape:
+            self.image.set_data(d[1])
+            self.image.set_extent(extent)
+            self.image.autoscale()
+        else:
+            self.clear_axes()
+            # imshow is a lot quicker than pcolormesh for big, evenly
+            # spaced grids.
+            self.image = self.axes.imshow(d[1], aspect="auto",
+                                          origin="lower",
+                                          interpolation="nearest",
+                                          extent=extent)
+            self.axes.grid(False)
+            self.fig.subplots_adjust(left=0.08, right=0.98,
+                                     bottom=0.05, top=0.92,
+                                     hspace=0.2, wspace=0.2)
+        self.axes.set_ylabel(plot_label(ylabel))
+        self.axes.set_title(plot_label(d[0]))
+        # Lines plotted after this start from scratch
+        self.data = None
 
 
+class MplWidgetNumerical(MplWidgetPlot):
+    """Simple mplWidget implementation."""
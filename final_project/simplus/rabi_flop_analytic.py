@@ -1,5 +1,26 @@
 from base_simulation import BaseSimulation
-from numpy import linspace, sin, pi, sqrt
+from numpy import linspace, sin, pi, sqrt, asarray, broadcast_arrays
+
+
+def rabi_probability(Ω, Δ, t):
+    '''
+    Excitation probability for a driven two level system.
+
+    Ω and Δ may be scalars or arrays, they are broadcast against each
+    other to give a grid of parameter points. t is added as the last
+    axis, so the result has shape broadcast(Ω, Δ).shape + (len(t),).
+    Everything is done in a single numpy call, no python loops.
+    '''
+    Ω, Δ = broadcast_arrays(asarray(Ω, dtype=float), asarray(Δ, dtype=float))
+    t = asarray(t, dtype=float)
+
+    Ω2 = Ω[..., None]**2
+    Δ2 = Δ[..., None]**2
+    C = Ω2 / (Ω2 + Δ2)
+    Ω0 = sqrt(Ω2 + Δ2)
+
+    return C * sin(2 * pi * Ω0 * t)**2
+
 
 class RabiFlopAnalytic(BaseSimulation):
 
@@ -7,24 +28,46 @@ class RabiFlopAnalytic(BaseSimulation):
 
         self.name = "Rabi Flop"
         self.type = "analytical"
+
+        # Sweeping Δ gives a 2D "chevron" map, which gets plotted as
+        # a heatmap instead of a single curve.
+        chevron = {"scan Δ": False,
+                   "Δ start": -10,
+                   "Δ stop": 10,
+                   "Δ points": 201}
+
         self.parameter_dict = {"Ω": (1, 0, 100, "MHz"),
                                "Δ": (0, 0, 100, "MHz"),
                                "duration": 5,
-                               "resolution": 1000}
+                               "resolution": 1000,
+                               "chevron map": chevron}
         self.model_information = (r"$P_{1\rightarrow 2} = $"
           r"$\frac{\Omega^2}{\Omega^2 + \Delta^2}\textrm{sin}^2(\sqrt{\Omega^2 + \Delta^2} t)$")
 
     def run(self, **kwargs):
+        '''
+        Ω and Δ can be passed in as arrays, in which case the
+        excitation probability is evaluated on the whole grid at once.
+        If the Δ scan is switched on, Δ is swept between 'Δ start' and
+        'Δ stop' and the returned trace is 2D with shape (Δ points, resolution).
+        '''
         Ω = kwargs["Ω"]
         Δ = kwargs["Δ"]
         duration = kwargs["duration"]
-        resolution = kwargs["resolution"]
+        resolution = int(kwargs["resolution"])
 
         t_list = linspace(0, duration, resolution)
 
-        C = Ω**2 / (Ω**2 + Δ**2)
-        Ω0 = sqrt(Ω**2 + Δ**2)
+        if kwargs.get("scan Δ", False):
+            Δ = linspace(kwargs["Δ start"], kwargs["Δ stop"],
+                         int(kwargs["Δ points"]))
+
+        Pe = rabi_probability(Ω, Δ, t_list)
 
-        Pe = [C * sin(2 * pi * Ω0 * t)**2 for t in t_list]
+        if Pe.ndim == 2 and asarray(Δ).ndim == 1:
+            # The third element holds the label and values of the y axis
+            # for the heatmap.
+            return [t_list, [r"$P_{1\rightarrow 2}$", Pe,
+                             [r"$\Delta$ (MHz)", asarray(Δ)]]]
 
         return [t_list, [r"$P_{1\rightarrow 2}$", Pe]]
@@ -1,9 +1,690 @@
-import useful_functions as uf
-from base_simulation import BaseSimulation
+import os
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from base_simulation import BaseSimulation, join_chunks
 from rabi_flop_numerical_model_info import model_info
-from qutip import *
-from numpy import pi, sqrt, linspace, array, real, imag
+from numpy import (pi, sqrt, linspace, array, real, imag, arange, exp,
+                   empty, conj, concatenate, stack, outer, ceil, log, diag,
+                   zeros, asarray, broadcast_to, eye, einsum, where,
+                   bincount, argsort, cumsum)
+from numpy.linalg import LinAlgError
+from numpy.random import randint
 from functools import partial
+from collections import OrderedDict
+from cache import LRUCache
+from trajectory_stats import TrajectoryStatistics
+
+
+def load_qutip():
+    '''
+    Import the parts of qutip used here. qutip takes a good while to
+    import, so this only happens once something is actually simulated,
+    not when the model is just listed or its parameters are shown.
+    '''
+    global Options, Qobj, basis, create, destroy, liouvillian, mcsolve
+    global mesolve, num, qeye, sigmap, sigmaz, tensor, thermal_dm, ui
+    if "mesolve" in globals():
+        return
+    from qutip import (Options, Qobj, basis, create, destroy, liouvillian,
+                       mcsolve, mesolve, num, qeye, sigmap, sigmaz, tensor,
+                       thermal_dm, ui)
+    import coeff_cache
+    # Reuse the compiled string coefficients across runs and processes
+    coeff_cache.install()
+
+
+def qobj_nbytes(ops):
+    '''Memory used by the sparse data of a list of [Qobj, coeff] terms.'''
+    nbytes = 0
+    for op, _ in ops:
+        nbytes += (op.data.data.nbytes + op.data.indices.nbytes +
+                   op.data.indptr.nbytes)
+    return nbytes
+
+
+# Prebuilt Hamiltonian terms keyed by (motional dimension, η, order),
+# or (motional dimension, η, "exact", sideband order) for exact coupling.
+operator_cache = LRUCache(max_bytes=256 * 2**20, sizeof=qobj_nbytes)
+
+
+def merge_terms(H):
+    '''
+    Sum the operators of terms that share the same coefficient, i.e. that
+    rotate at the same frequency, so the solver only has to do one sparse
+    mat-vec and one coefficient evaluation per distinct frequency.
+    '''
+    merged = OrderedDict()
+    for op, coeff in H:
+        if coeff in merged:
+            merged[coeff] = merged[coeff] + op
+        else:
+            merged[coeff] = op
+    return [[op, coeff] for coeff, op in merged.items()]
+
+
+def sideband_operators(M, η, order):
+    '''
+    Build the [operator, coefficient] terms of the Lamb-Dicke expanded
+    Hamiltonian up to 'order' in η, without the Ω/2 prefactor. Terms at
+    the same frequency are merged.
+    '''
+    return merge_terms(sideband_terms(M, η, order))
+
+
+def sideband_coeff(s, sign=1):
+    '''Coefficient string for the s'th sideband (s > 0 is blue).'''
+    if s == 0:
+        detuning = "delta"
+    elif s > 0:
+        detuning = "(delta-{}*nu)".format(s)
+    else:
+        detuning = "(delta+{}*nu)".format(-s)
+    if sign > 0:
+        return "exp(1j*(phi-{}*t))".format(detuning)
+    return "exp(-1j*(phi-{}*t))".format(detuning)
+
+
+def displacement_elements(M, η, s):
+    '''
+    The s'th diagonal of exp(iη(a + a†)) in a truncated Fock basis, i.e.
+    <n+s|exp(iη(a + a†))|n> for all n with 0 <= n, n+s < M, given by
+
+        exp(-η²/2) (iη)^|s| sqrt(n<!/n>!) L_n<^|s|(η²)
+
+    where n< and n> are the smaller and larger of n and n+s.
+    '''
+    from scipy.special import eval_genlaguerre, gammaln
+    k = abs(s)
+    n_lo = arange(M - k)
+    n_hi = n_lo + k
+    log_ratio = 0.5 * (gammaln(n_lo + 1) - gammaln(n_hi + 1))
+    return ((1j * η)**k * exp(-η**2 / 2 + log_ratio) *
+            eval_genlaguerre(n_lo, k, η**2))
+
+
+def exact_sideband_operators(M, η, smax):
+    '''
+    Build the [operator, coefficient] terms of the full interaction
+    σ+ exp(iη(a e^{-iνt} + a† e^{iνt})) + h.c., without the Ω/2
+    prefactor. The exponential is split into sidebands s, each a single
+    band of the motional operator rotating at δ - sν, and truncated at
+    |s| <= smax instead of at a power of η.
+    '''
+    load_qutip()
+    from scipy.sparse import diags
+    H = []
+    for s in range(-smax, smax + 1):
+        if abs(s) >= M:
+            continue
+        band = diags(displacement_elements(M, η, s), -s, shape=(M, M),
+                     format="csr")
+        op = tensor(sigmap(), Qobj(band))
+        H.append([op, sideband_coeff(s)])
+        H.append([op.dag(), sideband_coeff(s, -1)])
+    return H
+
+
+def sideband_terms(M, η, order):
+    '''
+    The individual terms of the Lamb-Dicke expansion, one per product of
+    ladder operators.
+    '''
+    load_qutip()
+    a = destroy(M)
+    adag = create(M)
+    IM = qeye(M)
+
+    H1 = tensor(sigmap(), IM)
+    H = [[H1, "exp(1j*(phi-delta*t))"],
+         [H1.dag(), "exp(-1j*(phi-delta*t))"]]
+
+    if order == 0:
+        return H
+
+    H2 = 1j * η * tensor(sigmap(), a)
+    H3 = 1j * η * tensor(sigmap(), adag)
+
+    H.append([H2, "exp(1j*(phi-(delta+nu)*t))"])
+    H.append([H3, "exp(1j*(phi-(delta-nu)*t))"])
+    H.append([H2.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
+    H.append([H3.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
+
+    if order == 1:
+        return H
+
+    H4 = -η**2 * tensor(sigmap(), a * a)
+    H5 = -η**2 * tensor(sigmap(), adag * adag)
+    H6 = -η**2 * tensor(sigmap(), IM)
+    H7 = -η**2 * tensor(sigmap(), 2 * adag * a)
+
+    H.append([H4, "exp(1j*(phi-(delta+2*nu)*t))"])
+    H.append([H5, "exp(1j*(phi-(delta-2*nu)*t))"])
+    H.append([H6, "exp(1j*(phi-delta*t))"])
+    H.append([H7, "exp(1j*(phi-delta*t))"])
+    H.append([H4.dag(), "exp(-1j*(phi-(delta+2*nu)*t))"])
+    H.append([H5.dag(), "exp(-1j*(phi-(delta-2*nu)*t))"])
+    H.append([H6.dag(), "exp(-1j*(phi-delta*t))"])
+    H.append([H7.dag(), "exp(-1j*(phi-delta*t))"])
+
+    if order == 2:
+        return H
+
+    H8 = -1j * η**3 * tensor(sigmap(), a * a * a)
+    H9 = -1j * η**3 * tensor(sigmap(), a * adag * adag)
+    H10 = -1j * η**3 * tensor(sigmap(), -a)
+    H11 = -1j * η**3 * tensor(sigmap(), 2 * a * a * adag)
+    H12 = -1j * η**3 * tensor(sigmap(), adag * a * a)
+    H13 = -1j * η**3 * tensor(sigmap(), adag * adag * adag)
+    H14 = -1j * η**3 * tensor(sigmap(), adag)
+    H15 = -1j * η**3 * tensor(sigmap(), 2 * adag * adag * a)
+
+    H.append([H8, "exp(1j*(phi-(delta+3*nu)*t))"])
+    H.append([H9, "exp(1j*(phi-(delta-nu)*t))"])
+    H.append([H10, "exp(1j*(phi-(delta+nu)*t))"])
+    H.append([H11, "exp(1j*(phi-(delta+nu)*t))"])
+    H.append([H12, "exp(1j*(phi-(delta+nu)*t))"])
+    H.append([H13, "exp(1j*(phi-(delta-3*nu)*t))"])
+    H.append([H14, "exp(1j*(phi-(delta-nu)*t))"])
+    H.append([H15, "exp(1j*(phi-(delta-nu)*t))"])
+    H.append([H8.dag(), "exp(-1j*(phi-(delta+3*nu)*t))"])
+    H.append([H9.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
+    H.append([H10.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
+    H.append([H11.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
+    H.append([H12.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
+    H.append([H13.dag(), "exp(-1j*(phi-(delta-3*nu)*t))"])
+    H.append([H14.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
+    H.append([H15.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
+
+    return H
+
+
+def electronic_e_ops(M):
+    '''
+    Operators whose expectation values give ρ11, ρ22 and ρ12 of the
+    electronic state, ρij = <i|ρ|j> = Tr(ρ |j><i|).
+    '''
+    load_qutip()
+    return [tensor(basis(2, 0) * basis(2, 0).dag(), qeye(M)),
+            tensor(basis(2, 1) * basis(2, 1).dag(), qeye(M)),
+            tensor(basis(2, 1) * basis(2, 0).dag(), qeye(M))]
+
+
+# When "time stepping" is "auto", the time independent rotating frame
+# Hamiltonian is used rather than the ODE solver up to these Hilbert
+# space dimensions, without and with dissipation. With dissipation it
+# acts on the vectorised density matrix, so computing it goes as the
+# dimension to the sixth power and it's only worth it for runs spanning
+# many periods of the fastest frequency around.
+MAX_PROPAGATOR_DIM = 200
+MAX_LIOUVILLIAN_DIM = 20
+PROPAGATOR_MIN_CYCLES = 100
+# Runs spanning more than this many periods jump straight to every time
+# with the Liouvillian's eigenmodes instead of stepping, see floquet_evolve.
+FLOQUET_MIN_CYCLES = 1000
+
+
+def sideband_order(kwargs):
+    '''The highest sideband order the coupling set in kwargs includes.'''
+    if kwargs.get("coupling") == "exact":
+        return int(kwargs["sideband order"])
+    return int(kwargs["order in η"])
+
+
+def resonant_sideband(kwargs):
+    '''The sideband, up to the order included, closest to resonance.'''
+    smax = sideband_order(kwargs)
+    if kwargs["ν"] == 0:
+        return 0
+    return min(range(-smax, smax + 1),
+               key=lambda s: abs(kwargs["Δ"] - s * kwargs["ν"]))
+
+
+def single_sideband(kwargs):
+    '''
+    The sideband driven if the coupling in kwargs only drives one, else
+    None. Decay to the ground state keeps the motional state, so it only
+    leaves the blocks of the carrier uncoupled.
+    '''
+    if kwargs.get("rotating wave approximation") == "resolved sideband":
+        return resonant_sideband(kwargs)
+    if sideband_order(kwargs) == 0:
+        return 0
+    return None
+
+
+def dissipative(kwargs):
+    '''True if the settings in kwargs include any decay or dephasing.'''
+    return kwargs["lifetime"] != 0 or kwargs["dephasing time"] != 0
+
+
+def free_hamiltonian(M, Δ, ν):
+    '''
+    The free electronic and motional Hamiltonian -Δσz/2 + ν a†a, i.e. what
+    the sideband Hamiltonian is in the interaction picture of.
+    '''
+    load_qutip()
+    return (-Δ / 2 * tensor(sigmaz(), qeye(M)) +
+            ν * tensor(qeye(2), num(M)))
+
+
+def rotating_frame_hamiltonian(H, args, M, Δ, ν):
+    '''
+    The sideband Hamiltonian H in the frame rotating with the free
+    Hamiltonian. The term of the s'th sideband rotates at δ - sν, exactly
+    as the free evolution of the operator it holds, so in that frame
+    every term keeps its value at t = 0 and the whole generator is time
+    independent, for any detuning, order and coupling.
+    '''
+    H_rot = free_hamiltonian(M, Δ, ν)
+    scope = dict(args, exp=exp, t=0)
+    for op, coeff in H:
+        H_rot = H_rot + complex(eval(coeff, scope)) * op
+    return H_rot
+
+
+def propagate(H, c_ops, ρ0, dt, counts, e_ops, keep_states=False):
+    '''
+    Evolve ρ0 under the time independent H and c_ops on a uniform time
+    grid with spacing dt. The one step propagator, exp(-iH dt) or exp(L dt)
+    for the Liouvillian L when there is dissipation, is computed once and
+    every point after that is a matrix product. For every n in counts,
+    yields the expectation values of e_ops, shape (len(e_ops), n), the
+    states (if keep_states) of the next n points, starting at ρ0, and the
+    last of those states.
+    '''
+    # scipy.linalg.expm (at least in scipy 1.12) can return garbage for
+    # some complex matrices, the sparse module's version is reliable
+    from scipy.sparse.linalg import expm
+    ρ = ρ0.full()
+    N = ρ.shape[0]
+    # Tr(ρE) as a dot product with the flattened ρ
+    rows = array([e.full().T.ravel() for e in e_ops])
+    if c_ops:
+        P = expm(liouvillian(H, c_ops).full() * dt)
+
+        def step(ρ):
+            # qutip's superoperators act on column stacked ρ
+            return (P @ ρ.ravel(order="F")).reshape((N, N), order="F")
+    else:
+        U = expm(-1j * H.full() * dt)
+        U_dag = U.conj().T
+
+        def step(ρ):
+            return U @ ρ @ U_dag
+
+    first = True
+    for n in counts:
+        expect = empty((len(e_ops), n), dtype=complex)
+        states = []
+        for k in range(n):
+            if first:
+                first = False
+            else:
+                ρ = step(ρ)
+            expect[:, k] = rows @ ρ.ravel()
+            if keep_states:
+                states.append(ρ)
+        yield expect, states, ρ
+
+
+# Liouvillians whose eigenvectors are worse conditioned than this are
+# too close to defective for floquet_evolve.
+MAX_MODE_CONDITION = 1e8
+
+
+def floquet_evolve(H, c_ops, ρ0, t_chunks, e_ops, keep_states=False):
+    '''
+    Evolve ρ0 under the time independent H and c_ops by expanding it in
+    the eigenmodes of the generator. H being the rotating frame version
+    of a periodically driven Hamiltonian, these are its Floquet modes,
+    and with dissipation the Floquet-Markov modes of the Liouvillian.
+    Every mode only picks up a factor exp(λt), so each time is jumped to
+    directly rather than stepped or integrated to, and the cost doesn't
+    depend on the duration at all.
+
+    For every array of times in t_chunks, yields the expectation values
+    of e_ops, shape (len(e_ops), len(t)), the states (if keep_states) and
+    the state at the last time. Raises LinAlgError if the Liouvillian is
+    too close to defective for its modes to be used.
+    '''
+    from numpy.linalg import eig, cond, solve
+    from scipy.linalg import eigh
+    ρ = ρ0.full()
+    N = ρ.shape[0]
+
+    if c_ops:
+        λ, V = eig(liouvillian(H, c_ops).full())
+        if cond(V) > MAX_MODE_CONDITION:
+            raise LinAlgError("Liouvillian eigenmodes are ill conditioned")
+        # Weights of the modes in ρ0, column stacked like qutip does
+        c = solve(V, ρ.ravel(order="F"))
+        # Tr(ρE) = E.ravel() . vec(ρ) for column stacked ρ
+        G = array([(e.full().ravel() @ V) * c for e in e_ops])
+    else:
+        # With H = V diag(E) V†, Tr(ρ(t) X) is the sum over a, b of
+        # R_ab X'_ba exp(-i(E_a - E_b)t), where R and X' are ρ0 and X
+        # in the eigenbasis.
+        E, V = eigh(H.full())
+        R = V.conj().T @ ρ @ V
+        W = [R * (V.conj().T @ e.full() @ V).T for e in e_ops]
+
+    def state_at(t):
+        if c_ops:
+            return (V @ (exp(λ * t) * c)).reshape((N, N), order="F")
+        Vp = V * exp(-1j * E * t)
+        return Vp @ R @ Vp.conj().T
+
+    def evolve():
+        for t in t_chunks:
+            n = len(t)
+            expect = empty((len(e_ops), n), dtype=complex)
+            # In blocks, to bound the memory used by the phases
+            for b in range(0, n, 4096):
+                tb = t[b:b + 4096]
+                if c_ops:
+                    phases = exp(outer(tb, λ))
+                    expect[:, b:b + len(tb)] = G @ phases.T
+                else:
+                    phases = exp(-1j * outer(tb, E))
+                    for i, w in enumerate(W):
+                        expect[i, b:b + len(tb)] = (
+                            (phases @ w) * phases.conj()).sum(1)
+            states = [state_at(tk) for tk in t] if keep_states else []
+            yield expect, states, state_at(t[-1])
+
+    return evolve()
+
+
+# Blocks bigger than this aren't worth handling separately.
+MAX_BLOCK_DIM = 8
+
+
+def find_blocks(H, c_ops):
+    '''
+    Split the Hilbert space into the blocks that H and c_ops don't couple
+    to each other, e.g. the |g,n>, |e,n> pairs of the carrier or the
+    |g,n>, |e,n+s> pairs of a resolved sideband. Returns the indices of
+    the states in every block, as one (number of blocks, size) array per
+    block size, or None if there aren't several small blocks.
+    '''
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+    coupled = 0
+    for op in [H] + c_ops:
+        d = op.data
+        coupled = coupled + csr_matrix((abs(d.data), d.indices, d.indptr),
+                                       shape=d.shape)
+    count, labels = connected_components(coupled, directed=False)
+    sizes = bincount(labels)
+    if count == 1 or sizes.max() > MAX_BLOCK_DIM:
+        return None
+    # The states of every block are contiguous once sorted by block
+    members = argsort(labels, kind="stable")
+    starts = concatenate([[0], cumsum(sizes)[:-1]])
+    groups = OrderedDict()
+    for start, size in zip(starts, sizes):
+        groups.setdefault(size, []).append(members[start:start + size])
+    return [array(g) for g in groups.values()]
+
+
+def block_evolve(H, c_ops, ρ0, blocks, t_chunks, e_ops, keep_states=False):
+    '''
+    Same as floquet_evolve, for an H and c_ops that don't couple the
+    'blocks' of the Hilbert space (see find_blocks). The parts of ρ0
+    within every block then evolve on their own, so the generators of
+    the blocks are diagonalised separately, all the blocks of the same
+    size at once as a stack of small matrices. Raises ValueError if ρ0
+    has coherences between blocks.
+    '''
+    from numpy.linalg import eig, eigh, cond, solve
+    ρ = ρ0.full()
+    N = ρ.shape[0]
+    H = H.data.tocsr()
+    # Every block size gives the rates μ and weights g (one row per e_op)
+    # of its modes, each contributing g exp(μt) to the expectation values
+    groups = []
+    μ = []
+    g = []
+    in_blocks = 0
+
+    def stack(op, r, c):
+        return asarray(op[r.ravel(), c.ravel()]).reshape(r.shape)
+
+    for idx in blocks:
+        n, b = idx.shape
+        r = broadcast_to(idx[:, :, None], (n, b, b))
+        c = broadcast_to(idx[:, None, :], (n, b, b))
+        ρb = ρ[r, c]
+        in_blocks += abs(ρb).sum()
+        Eb = [stack(e.data.tocsr(), r, c) for e in e_ops]
+        Hb = stack(H, r, c)
+        if c_ops:
+            def skron(A, B):
+                # kron of every pair of blocks
+                return (A[:, :, None, :, None] *
+                        B[:, None, :, None, :]).reshape((n, b * b, b * b))
+            one = broadcast_to(eye(b), (n, b, b))
+            # The Liouvillian acting on the column stacked ρ of every
+            # block, using vec(AXB) = (B^T ⊗ A) vec(X)
+            L = -1j * (skron(one, Hb) - skron(Hb.transpose(0, 2, 1), one))
+            for op in c_ops:
+                cb = stack(op.data.tocsr(), r, c)
+                cdc = cb.conj().transpose(0, 2, 1) @ cb
+                L += (skron(cb.conj(), cb) - 0.5 * skron(one, cdc) -
+                      0.5 * skron(cdc.transpose(0, 2, 1), one))
+            λ, V = eig(L)
+            if cond(V).max() > MAX_MODE_CONDITION:
+                raise LinAlgError("Liouvillian eigenmodes are ill "
+                                  "conditioned")
+            w = solve(V, ρb.transpose(0, 2, 1).reshape((n, b * b, 1)))[..., 0]
+            # Tr(ρE) = E.ravel() . vec(ρ) for column stacked ρ
+            g.append(array([(einsum("km,kmj->kj", e.reshape((n, b * b)), V)
+                             * w).ravel() for e in Eb]))
+            μ.append(λ.ravel())
+            groups.append((r, c, V, w, λ))
+        else:
+            E, V = eigh(Hb)
+            Vd = V.conj().transpose(0, 2, 1)
+            R = Vd @ ρb @ V
+            # Tr(ρ(t) X) is the sum of R_ac X'_ca exp(-i(E_a - E_c)t)
+            g.append(array([(R * (Vd @ e @ V).transpose(0, 2, 1)).ravel()
+                            for e in Eb]))
+            μ.append((-1j * (E[:, :, None] - E[:, None, :])).ravel())
+            groups.append((r, c, V, R, E))
+
+    if abs(ρ).sum() - in_blocks > 1e-10:
+        raise ValueError("initial state has coherences between blocks")
+    μ = concatenate(μ)
+    g = concatenate(g, axis=1)
+
+    def state_at(t):
+        state = zeros((N, N), dtype=complex)
+        for r, c, V, w, λ in groups:
+            if c_ops:
+                vec = einsum("kij,kj->ki", V, exp(λ * t) * w)
+                n, b = r.shape[:2]
+                state[r, c] = vec.reshape((n, b, b)).transpose(0, 2, 1)
+            else:
+                # w and λ are R and the energies here
+                Vp = V * exp(-1j * λ * t)[:, None, :]
+                state[r, c] = Vp @ w @ Vp.conj().transpose(0, 2, 1)
+        return state
+
+    def evolve():
+        # Blocks of times, to bound the memory used by the phases
+        step = max(1, 2**22 // len(μ))
+        for t in t_chunks:
+            expect = empty((len(e_ops), len(t)), dtype=complex)
+            for k in range(0, len(t), step):
+                expect[:, k:k + step] = g @ exp(outer(μ, t[k:k + step]))
+            states = [state_at(tk) for tk in t] if keep_states else []
+            yield expect, states, state_at(t[-1])
+
+    return evolve()
+
+
+def resolved_sideband(H, M, s):
+    '''
+    The rotating wave approximation for a resolved sideband: keep only
+    the parts of the terms of H that drive the s'th sideband, i.e. that
+    couple |1,n> and |0,n+s>, dropping all the off resonant couplings.
+    '''
+    from scipy.sparse import coo_matrix
+    kept = []
+    for op, coeff in H:
+        data = op.data.tocoo()
+        e_row, n_row = divmod(data.row, M)
+        e_col, n_col = divmod(data.col, M)
+        # σ+ takes electronic state 1 to 0
+        change = where(e_row < e_col, n_row - n_col, n_col - n_row)
+        keep = (e_row != e_col) & (change == s)
+        if keep.any():
+            band = coo_matrix((data.data[keep], (data.row[keep],
+                                                 data.col[keep])),
+                              shape=data.shape)
+            kept.append([Qobj(band.tocsr(), dims=op.dims), coeff])
+    return kept
+
+
+# Below this Hilbert space dimension the kets of a mixed state are cheap
+# enough to evolve that starting a process pool for them doesn't pay.
+MIN_PARALLEL_KET_DIM = 40
+
+
+def evolve_kets(H, args, kets, weights, t_list, e_ops, nsteps,
+                keep_states=False):
+    '''
+    Integrate the Schrodinger equation for all the columns of 'kets' at
+    once over t_list, with the integrator and tolerances mesolve uses.
+    Returns the expectation values of e_ops and the density matrices (if
+    keep_states) of the mixture of the kets with the given weights, and
+    the kets at the last time. Lives at module level so the process pool
+    can pickle it.
+    '''
+    from scipy.integrate import ode
+    ops = [op.data for op, _ in H]
+    coeffs = [compile(c, "<coefficient>", "eval") for _, c in H]
+    scope = dict(args, exp=exp)
+    shape = kets.shape
+
+    def rhs(t, y):
+        scope["t"] = t
+        Ψ = y.reshape(shape)
+        dΨ = zeros(shape, dtype=complex)
+        for op, c in zip(ops, coeffs):
+            dΨ += eval(c, scope) * (op @ Ψ)
+        return -1j * dΨ.ravel()
+
+    solver = ode(rhs).set_integrator("zvode", method="adams", atol=1e-8,
+                                     rtol=1e-6, nsteps=nsteps)
+    solver.set_initial_value(kets.ravel(), t_list[0])
+    E = [e.data for e in e_ops]
+    expect = empty((len(e_ops), len(t_list)), dtype=complex)
+    states = []
+    Ψ = kets
+    for k, t in enumerate(t_list):
+        if k:
+            Ψ = solver.integrate(t).reshape(shape)
+            if not solver.successful():
+                raise RuntimeError("Schrodinger equation integration failed,"
+                                   " try increasing the number of steps")
+        wΨ = Ψ * weights
+        for i, e in enumerate(E):
+            # The weighted sum of <ψ|E|ψ> over the kets
+            expect[i, k] = (Ψ.conj() * (e @ wΨ)).sum()
+        if keep_states:
+            states.append(wΨ @ Ψ.conj().T)
+    return expect, states, Ψ
+
+
+# Auto truncation never grows the motional space beyond this.
+MAX_MOTIONAL_DIM = 100
+
+
+def motional_dimension(nbar, reach, tolerance):
+    '''
+    Smallest motional dimension that holds all but 'tolerance' of the
+    population of a thermal state with mean occupation nbar, with room on
+    top for the sidebands, which move up to 'reach' levels at a time.
+    '''
+    levels = 1
+    if nbar > 0:
+        # The population of level n and above is (nbar / (nbar + 1))^n
+        levels = int(ceil(log(max(tolerance, 1e-15)) /
+                          log(nbar / (nbar + 1))))
+    return max(levels, 1) + 2 * max(reach, 1)
+
+
+def top_levels(M, k):
+    '''Projector onto the top k Fock levels of the motional space.'''
+    load_qutip()
+    return tensor(qeye(2), Qobj(diag((arange(M) >= M - k) * 1.)))
+
+
+def embed_motion(ρ, M):
+    '''Pad the motional part of the density matrix ρ out to dimension M.'''
+    m = ρ.dims[0][1]
+    if m == M:
+        return ρ
+    padded = zeros((2, M, 2, M), dtype=complex)
+    padded[:, :m, :, :m] = ρ.full().reshape((2, m, 2, m))
+    return Qobj(padded.reshape((2 * M, 2 * M)), dims=[[2, M], [2, M]])
+
+
+def reduced_states(ρ11, ρ22, ρ12):
+    '''Stack the electronic ρ elements into a (res, 2, 2) array.'''
+    states = empty((len(ρ11), 2, 2), dtype=complex)
+    states[:, 0, 0] = ρ11
+    states[:, 1, 1] = ρ22
+    states[:, 0, 1] = ρ12
+    states[:, 1, 0] = conj(ρ12)
+    return states
+
+
+def electronic_data(t_list, expect, ρ11, ρ22, ρ12, errors=None):
+    '''
+    Pick out the ρ elements selected in the plot options. If given,
+    'errors' holds the error bars of ρ11, ρ22, Re(ρ12) and Im(ρ12),
+    which are added as the third element of each trace.
+    '''
+    data = [t_list]
+    if ρ11:
+        data.append([r"$\rho_{11}$", abs(real(expect[0]))])
+    if ρ22:
+        data.append([r"$\rho_{22}$", abs(real(expect[1]))])
+    if ρ12:
+        data.append([r"$Re(\rho_{12})$", real(expect[2])])
+        data.append([r"$Im(\rho_{12})$", imag(expect[2])])
+    if errors is not None:
+        selected = [ρ11, ρ22, ρ12, ρ12]
+        for d, e in zip(data[1:], [e for e, on in zip(errors, selected)
+                                   if on]):
+            d.append(e)
+    return data
+
+
+def trajectory_samples(expect):
+    '''
+    Turn per trajectory expectation values of electronic_e_ops into real
+    samples of ρ11, ρ22, Re(ρ12) and Im(ρ12), shape (ntraj, 4, res).
+    '''
+    expect = array([list(e) for e in expect], dtype=complex)
+    return stack([real(expect[:, 0]), real(expect[:, 1]),
+                  real(expect[:, 2]), imag(expect[:, 2])], axis=1)
+
+
+def new_seeds(n, used):
+    '''n random trajectory seeds that aren't in 'used'.'''
+    used = set(used)
+    seeds = []
+    while len(seeds) < n:
+        seed = int(randint(0, 2**32, dtype="int64"))
+        if seed not in used:
+            used.add(seed)
+            seeds.append(seed)
+    return seeds
+
 
 class RabiFlopNumerical(BaseSimulation):
 
@@ -13,7 +694,13 @@ class RabiFlopNumerical(BaseSimulation):
         self.type = "numerical"
 
         sim_params = {"number of steps": 1000, "resolution": 10,
-                      "duration": (1, 1, 10000, "μsec")}
+                      "duration": (1, 1, 10000, "μsec"),
+                      "stream chunks": 10,
+                      "time stepping": ["auto",
+                                        ["auto", "blocks", "propagator",
+                                         "floquet", "ode"]],
+                      "state history": ["reduced",
+                                        ["none", "reduced", "full"]]}
 
         driving_field = {"Δ": (0, -10, 10, "MHz"),
                          "Ω": (1, -10, 10, "MHz"),
@@ -25,9 +712,17 @@ class RabiFlopNumerical(BaseSimulation):
 
         mot = {"nbar": 0,
                "motional dimension": 10,
+               "truncation": ["fixed", ["fixed", "auto"]],
+               "leakage tolerance": 1e-4,
+               "thermal weight tolerance": 1e-8,
                "η": .1,
                "ν": (1, -100, 100, "MHz")}
 
+        monte_carlo = {"target error": 0.01,
+                       "max trajectories": 2000,
+                       "batch size": 64,
+                       "refine trajectories": 256}
+
         plot_opts = {"ρ11": True,
                      "ρ22": False,
                      "ρ12": False}
@@ -36,8 +731,14 @@ class RabiFlopNumerical(BaseSimulation):
                                "driving field": driving_field,
                                "elec state info": elec,
                                "motional state info": mot,
+                               "monte carlo": monte_carlo,
                                "plot options": plot_opts,
-                               "order in η": ["1", ["0", "1", "2", "3"]]
+                               "order in η": ["1", ["0", "1", "2", "3"]],
+                               "coupling": ["Lamb-Dicke expansion",
+                                            ["Lamb-Dicke expansion", "exact"]],
+                               "rotating wave approximation": [
+                                   "none", ["none", "resolved sideband"]],
+                               "sideband order": 2
                                }
 
         self.model_information = model_info
@@ -49,80 +750,241 @@ class RabiFlopNumerical(BaseSimulation):
         Δ = 2 * pi * kwargs["Δ"]
         η = kwargs["η"]
         ν = 2 * pi * kwargs["ν"]
-        M = kwargs["motional dimension"]
-        order = int(kwargs["order in η"])
+        M = int(kwargs["motional dimension"])
 
+        # "exact" coupling keeps the whole exponential, truncated by
+        # sideband order rather than by powers of η.
+        if kwargs.get("coupling", "Lamb-Dicke expansion") == "exact":
+            order = int(kwargs["sideband order"])
+            key = (M, η, "exact", order)
+            build = partial(exact_sideband_operators, M, η, order)
+        else:
+            order = int(kwargs["order in η"])
+            key = (M, η, order)
+            build = partial(sideband_operators, M, η, order)
+
+        # The operators only depend on M, η and the order, so they come
+        # out of the cache; only the Rabi frequency changes between runs.
         C = Ω / 2
-        a = destroy(M)
-        adag = create(M)
-        IM = qeye(M)
-
-        H1 = C * tensor(sigmap(), IM)
-        H2 = C * 1j * η * tensor(sigmap(), a)
-        H3 = C * 1j * η * tensor(sigmap(), adag)
-        H4 = C * -η**2 * tensor(sigmap(), a * a)
-        H5 = C * -η**2 * tensor(sigmap(), adag * adag)
-        H6 = C * -η**2 * tensor(sigmap(), IM)
-        H7 = C * -η**2 * tensor(sigmap(), 2 * adag * a)
-        H8 = C * -1j * η**3 * tensor(sigmap(), a * a * a)
-        H9 = C * -1j * η**3 * tensor(sigmap(), a * adag * adag)
-        H10 = C * -1j * η**3 * tensor(sigmap(), -a)
-        H11 = C * -1j * η**3 * tensor(sigmap(), 2 * a * a * adag)
-        H12 = C * -1j * η**3 * tensor(sigmap(), adag * a * a)
-        H13 = C * -1j * η**3 * tensor(sigmap(), adag * adag * adag)
-        H14 = C * -1j * η**3 * tensor(sigmap(), adag)
-        H15 = C * -1j * η**3 * tensor(sigmap(), 2 * adag * adag * a)
-
-        H = [[H1, "exp(1j*(phi-delta*t))"],
-             [H1.dag(), "exp(-1j*(phi-delta*t))"]]
+        H = [[C * op, coeff] for op, coeff in operator_cache.get(key, build)]
+        if kwargs.get("rotating wave approximation") == "resolved sideband":
+            H = resolved_sideband(H, M, resonant_sideband(kwargs))
 
         if order == 0:
             args = {"phi": phi, "delta": Δ}
-            return H, args
-
-        H.append([H2, "exp(1j*(phi-(delta+nu)*t))"])
-        H.append([H3, "exp(1j*(phi-(delta-nu)*t))"])
-        H.append([H2.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
-        H.append([H3.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
-
-        args = {"phi": phi, "delta": Δ, "nu": ν}
-
-        if order == 1:
-            return H, args
-
-        H.append([H4, "exp(1j*(phi-(delta+2*nu)*t))"])
-        H.append([H5, "exp(1j*(phi-(delta-2*nu)*t))"])
-        H.append([H6, "exp(1j*(phi-delta*t))"])
-        H.append([H7, "exp(1j*(phi-delta*t))"])
-        H.append([H4.dag(), "exp(-1j*(phi-(delta+2*nu)*t))"])
-        H.append([H5.dag(), "exp(-1j*(phi-(delta-2*nu)*t))"])
-        H.append([H6.dag(), "exp(-1j*(phi-delta*t))"])
-        H.append([H7.dag(), "exp(-1j*(phi-delta*t))"])
-
-        if order == 2:
-            return H, args
-
-        H.append([H8, "exp(1j*(phi-(delta+3*nu)*t))"])
-        H.append([H9, "exp(1j*(phi-(delta-nu)*t))"])
-        H.append([H10, "exp(1j*(phi-(delta+nu)*t))"])
-        H.append([H11, "exp(1j*(phi-(delta+nu)*t))"])
-        H.append([H12, "exp(1j*(phi-(delta+nu)*t))"])
-        H.append([H13, "exp(1j*(phi-(delta-3*nu)*t))"])
-        H.append([H14, "exp(1j*(phi-(delta-nu)*t))"])
-        H.append([H15, "exp(1j*(phi-(delta-nu)*t))"])
-        H.append([H8.dag(), "exp(-1j*(phi-(delta+3*nu)*t))"])
-        H.append([H9.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
-        H.append([H10.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
-        H.append([H11.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
-        H.append([H12.dag(), "exp(-1j*(phi-(delta+nu)*t))"])
-        H.append([H13.dag(), "exp(-1j*(phi-(delta-3*nu)*t))"])
-        H.append([H14.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
-        H.append([H15.dag(), "exp(-1j*(phi-(delta-nu)*t))"])
+        else:
+            args = {"phi": phi, "delta": Δ, "nu": ν}
 
         return H, args
 
+    def prewarm(self):
+        '''Compile the time dependent coefficients for every order in η.'''
+        p = self.default_settings()
+        p["motional dimension"] = 2
+        hamiltonians = []
+        for order in self.parameter_dict["order in η"][-1]:
+            p["order in η"] = order
+            hamiltonians.append(self.Hamiltonian(**p))
+        p["coupling"] = "exact"
+        p["motional dimension"] = 4
+        for order in range(4):
+            p["sideband order"] = order
+            hamiltonians.append(self.Hamiltonian(**p))
+        import coeff_cache
+        coeff_cache.prewarm(hamiltonians)
+
+    def choose_solver(self, **kwargs):
+        '''
+        When only one sideband is driven the master equation solver
+        handles the small blocks it splits into all at once, which beats
+        everything else. Otherwise, without dissipation the kets making up
+        the initial state are all that needs evolving: the Schrodinger
+        solver does that, except for thermal states in spaces small enough
+        for the master equation solver to use their Floquet modes. With
+        dissipation, trajectories only pay off once the density matrix is
+        bigger than the number of kets needed to get the plotted elements
+        to the target error, and they can only start from a pure state and
+        don't give the full state history.
+        '''
+        M = int(kwargs["motional dimension"])
+        pure = kwargs["nbar"] == 0
+        if single_sideband(kwargs) == 0 or (single_sideband(kwargs) and
+                                            kwargs["lifetime"] == 0):
+            return ("run_master_equation", "only one sideband is driven, so "
+                    "the master equation splits into small blocks")
+        if not dissipative(kwargs):
+            if pure:
+                return ("run_schrodinger", "without dissipation the pure "
+                        "initial state stays a single ket")
+            if 2 * M > MAX_PROPAGATOR_DIM:
+                return ("run_schrodinger", "without dissipation the thermal "
+                        "state's kets can be evolved separately")
+            return ("run_master_equation", "without dissipation the "
+                    "thermal state evolves through its Floquet modes")
+        if kwargs.get("state history", "reduced") == "full":
+            return ("run_master_equation", "the full state history needs "
+                    "the density matrix")
+        if not pure:
+            return ("run_master_equation", "trajectories can't start from "
+                    "a thermal state")
+        target = kwargs.get("target error", 0)
+        ntraj = int(kwargs.get("max trajectories", 500))
+        if target > 0:
+            # The standard error of a probability is at most 1/(2√n)
+            ntraj = min(ntraj, int(ceil(1 / (4 * target**2))))
+        if 2 * M > ntraj:
+            return ("run_monte_carlo", "{} trajectories are cheaper than "
+                    "a {} dimensional density matrix".format(ntraj, 2 * M))
+        return ("run_master_equation", "a {} dimensional density matrix is "
+                "cheaper than {} trajectories".format(2 * M, ntraj))
+
+    def run_schrodinger(self, **kwargs):
+        return join_chunks(self.iter_run_schrodinger(**kwargs))
+
+    def iter_run_schrodinger(self, **kwargs):
+        '''
+        Evolve the kets the initial state is a mixture of with the
+        Schrodinger equation, streaming like iter_run_master_equation.
+        Only possible without dissipation.
+        '''
+        if dissipative(kwargs):
+            raise ValueError("the Schrodinger solver can't include "
+                             "dissipation, set the lifetime and dephasing "
+                             "time to 0")
+        # Without collapse operators the ODE path evolves kets
+        kwargs = dict(kwargs, **{"time stepping": "ode"})
+        return self.iter_run_master_equation(**kwargs)
+
     def run_master_equation(self, **kwargs):
+        return join_chunks(self.iter_run_master_equation(**kwargs))
+
+    def iter_run_master_equation(self, **kwargs):
+        '''
+        Integrate the master equation in 'stream chunks' pieces, each one
+        starting from the final state of the last, and yield the data for
+        every piece as soon as it is done.
+
+        With "truncation" set to "auto" the motional dimension is picked
+        from nbar and the sideband order instead, and the population of
+        the top Fock levels is watched as the run goes. Whenever it gets
+        above the 'leakage tolerance' during a piece, the motional space
+        is grown and that piece is redone. The dimension used and the
+        largest top level population seen are added to the labels of the
+        last piece, and kept in self.truncation.
+        '''
+        nbar = kwargs["nbar"]
+        res = int(kwargs["resolution"])
+        duration = kwargs["duration"]
+        init_state = kwargs["initial state"]
+        M = int(kwargs["motional dimension"])
+        ρ11 = kwargs["ρ11"]
+        ρ22 = kwargs["ρ22"]
+        ρ12 = kwargs["ρ12"]
+
+        # How many motional levels the sidebands move at a time
+        reach = sideband_order(kwargs) if kwargs["η"] else 0
+        top = max(reach, 1)
+        tolerance = kwargs.get("leakage tolerance", 1e-4)
+        auto = kwargs.get("truncation", "fixed") == "auto"
+        if auto:
+            M = min(motional_dimension(nbar, reach, tolerance),
+                    MAX_MOTIONAL_DIM)
+
+        if nbar >= M:
+            warnings.warn("nbar = {} doesn't fit in a motional dimension of "
+                          "{}, using nbar = {}".format(nbar, M, M - 1))
+            nbar = M - 1
+
+        load_qutip()
+        if init_state == "ground":
+            state = tensor(basis(2, 0) * basis(2, 0).dag(),
+                           thermal_dm(M, nbar))
+        else:
+            state = tensor(basis(2, 1) * basis(2, 1).dag(),
+                           thermal_dm(M, nbar))
+
+        t_list = linspace(0, duration, res)
+        chunks = max(1, min(int(kwargs.get("stream chunks", 1)), res))
+        bounds = linspace(0, res, chunks + 1).astype(int)
+
+        # The ρ elements are evaluated as the state is evolved rather than
+        # from the stored states afterwards.
+        history = kwargs.get("state history", "reduced")
 
+        states = []
+        expect = [[], [], []]
+        leakage = 0
+        done = 0
+        while done < chunks:
+            pieces = self._evolve(M, top, state, t_list, bounds[done:],
+                                  history == "full", **kwargs)
+            for start, stop, chunk, chunk_states, final in pieces:
+                populated = real(chunk[3]).max()
+                if auto and populated > tolerance and M < MAX_MOTIONAL_DIM:
+                    # The dimension finally used ends up in the labels
+                    M = min(M + max(2 * top, M // 2), MAX_MOTIONAL_DIM)
+                    state = embed_motion(state, M)
+                    break
+                leakage = max(leakage, populated)
+                state = final
+                done += 1
+                for e, c in zip(expect, chunk):
+                    e.append(c)
+                states.extend(chunk_states)
+                data = electronic_data(t_list[start:stop], chunk, ρ11, ρ22,
+                                       ρ12)
+                if done == chunks and auto:
+                    for d in data[1:]:
+                        d[0] += ", M = {}, leakage {:.1g}".format(M, leakage)
+                yield data
+
+        if leakage > tolerance:
+            warnings.warn("{:.2g} of the population reached the top Fock "
+                          "levels, the motional dimension {} is too "
+                          "small".format(leakage, M))
+        self.truncation = (M, leakage)
+
+        expect = [concatenate(e) for e in expect]
+        if history == "full":
+            self.states = [embed_motion(ρ, M) for ρ in states]
+        elif history == "reduced":
+            self.states = reduced_states(*expect)
+        else:
+            self.states = []
+
+    def run_details(self):
+        '''The state history and the truncation of the last run.'''
+        details = {}
+        if getattr(self, "truncation", None) is not None:
+            details["truncation"] = array(self.truncation)
+        states = getattr(self, "states", [])
+        if len(states) and hasattr(states[0], "full"):
+            details["full states"] = array([ρ.full() for ρ in states])
+        elif len(states):
+            details["reduced states"] = asarray(states)
+        return details
+
+    def restore_run_details(self, details):
+        self.truncation = None
+        if "truncation" in details:
+            M, leakage = details["truncation"]
+            self.truncation = (int(M), leakage)
+        self.states = []
+        if "full states" in details:
+            load_qutip()
+            M = details["full states"].shape[-1] // 2
+            self.states = [Qobj(ρ, dims=[[2, M], [2, M]])
+                           for ρ in details["full states"]]
+        elif "reduced states" in details:
+            self.states = details["reduced states"]
+
+    def _evolve(self, M, top, state, t_list, bounds, keep_states, **kwargs):
+        '''
+        Set the system up with motional dimension M and return the pieces
+        of the evolution of 'state' over bounds, see _ode_chunks. Besides
+        the ρ elements, the population of the 'top' highest Fock levels
+        is evaluated.
+        '''
         try:
             γ2 = sqrt(1 / (kwargs["lifetime"] * 1e6))
         except ZeroDivisionError:
@@ -131,15 +993,7 @@ class RabiFlopNumerical(BaseSimulation):
             γ12 = sqrt(1 / kwargs["dephasing time"])
         except ZeroDivisionError:
             γ12 = 0
-        nbar = kwargs["nbar"]
-        nsteps = kwargs["number of steps"]
-        res = kwargs["resolution"]
         duration = kwargs["duration"]
-        init_state = kwargs["initial state"]
-        M = kwargs["motional dimension"]
-        ρ11 = kwargs["ρ11"]
-        ρ22 = kwargs["ρ22"]
-        ρ12 = kwargs["ρ12"]
 
         c_ops = []
         if γ2 != 0:
@@ -149,41 +1003,230 @@ class RabiFlopNumerical(BaseSimulation):
             dephasing = tensor(sqrt(γ12) * sigmaz(), qeye(M))  # pure dephasing
             c_ops.append(dephasing)
 
-        t_list = linspace(0, duration, res)
+        H, args = self.Hamiltonian(**dict(kwargs, **{"motional dimension": M}))
+        e_ops = electronic_e_ops(M) + [top_levels(M, top)]
 
-        if nbar >= M:
-                nbar = M - 1
+        # In the frame rotating with the free Hamiltonian the generator is
+        # time independent. Without dissipation its eigenmodes (the
+        # Floquet modes of the sideband Hamiltonian) give the state at
+        # any time directly, with dissipation the same one step propagator
+        # takes every point of the uniform time grid to the next. Long
+        # dissipative runs use the Liouvillian's eigenmodes too, unless
+        # they are ill conditioned. The ODE solver is used when the system
+        # is too big for dense matrices, on the kets making up the state
+        # when there's no dissipation.
+        stepping = kwargs.get("time stepping", "auto")
+        ν = 2 * pi * kwargs["ν"]
+        if stepping == "auto" and find_blocks(
+                rotating_frame_hamiltonian(H, args, M, args["delta"], ν),
+                c_ops) is not None:
+            # Nothing couples the small blocks (e.g. the carrier's |g,n>,
+            # |e,n> pairs), which are then handled all at once
+            stepping = "blocks"
+        elif stepping == "auto":
+            if c_ops:
+                cycles = duration * (abs(kwargs["Ω"]) + abs(kwargs["Δ"]) +
+                                     sideband_order(kwargs) *
+                                     abs(kwargs["ν"]))
+                if (2 * M > MAX_LIOUVILLIAN_DIM or
+                        cycles < PROPAGATOR_MIN_CYCLES):
+                    stepping = "ode"
+                elif cycles >= FLOQUET_MIN_CYCLES:
+                    stepping = "floquet"
+                else:
+                    stepping = "propagator"
+            elif 2 * M <= MAX_PROPAGATOR_DIM:
+                stepping = "floquet"
+            else:
+                stepping = "ode"
+        if stepping in ("blocks", "propagator", "floquet"):
+            return self._static_chunks(H, args, c_ops, state, t_list, bounds,
+                                       e_ops, keep_states, M, ν, stepping)
+        if not c_ops:
+            return self._ket_chunks(H, args, state, t_list, bounds, e_ops,
+                                    keep_states, kwargs["number of steps"],
+                                    kwargs.get("thermal weight tolerance",
+                                               0))
+        return self._ode_chunks(H, args, c_ops, state, t_list, bounds, e_ops,
+                                keep_states, kwargs["number of steps"])
 
-        if init_state == "ground":
-            init_state = tensor(basis(2, 0) * basis(2, 0).dag(),
-                                thermal_dm(M, nbar))
+    def _ode_chunks(self, H, args, c_ops, init_state, t_list, bounds,
+                    e_ops, keep_states, nsteps):
+        '''
+        Integrate the master equation with mesolve a chunk at a time,
+        yielding (start, stop, expectation values, states, final state)
+        for each. init_state is the state at the time just before
+        bounds[0], or at the first time if that's 0.
+        '''
+        # With a single chunk there's nothing to watch on the plot, so
+        # show progress in the terminal instead.
+        if len(bounds) == 2:
+            progress_bar = ui.TextProgressBar()
         else:
-            init_state = tensor(basis(2, 1) * basis(2, 1).dag(),
-                                thermal_dm(M, nbar))
+            progress_bar = None
+        options = Options(nsteps=nsteps, store_states=keep_states,
+                          store_final_state=True)
 
-        H, args = self.Hamiltonian(**kwargs)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            # Every chunk after the first restarts from the last time of
+            # the one before, which is dropped from the output.
+            first = max(start - 1, 0)
+            output = mesolve(H, init_state, t_list[first:stop], c_ops, e_ops,
+                             args=args, options=options,
+                             progress_bar=progress_bar)
+            init_state = output.final_state
+            skip = start - first
+            chunk = [e[skip:] for e in output.expect]
+            states = output.states[skip:] if keep_states else []
+            yield start, stop, chunk, states, init_state
 
-        output = mesolve(H, init_state, t_list, c_ops, [], args=args,
-                         options=Options(nsteps=nsteps),
-                         progress_bar=ui.TextProgressBar())
+    def _ket_chunks(self, H, args, init_state, t_list, bounds, e_ops,
+                    keep_states, nsteps, tolerance):
+        '''
+        Same as _ode_chunks, for when there's no dissipation. The evolution
+        is then linear in the state, so instead of integrating the whole
+        density matrix, init_state is split into the kets it's a mixture
+        of (the Fock states of a thermal state) and those are evolved with
+        the Schrodinger equation, spread over a pool of self.processes
+        processes. Kets with weights below 'tolerance' are left out.
+        '''
+        from scipy.linalg import eigh
+        weights, kets = eigh(init_state.full())
+        kept = weights > max(tolerance, 0)
+        weights = weights[kept] / weights[kept].sum()
+        kets = kets[:, kept]
 
-        self.states = output.states
+        processes = min(self.processes or os.cpu_count() or 1, len(weights))
+        # Daemonic processes can't start a pool
+        if (init_state.shape[0] < MIN_PARALLEL_KET_DIM or
+                multiprocessing.current_process().daemon):
+            processes = 1
+        # Every worker keeps evolving the same kets from chunk to chunk
+        groups = [arange(i, len(weights), processes)
+                  for i in range(processes)]
+        pool = ProcessPoolExecutor(processes) if processes > 1 else None
 
-        data = [t_list]
-        if ρ11:
-            ρ11 = abs(array(parfor(partial(uf.ρ, 1, 1), self.states)))
-            data.append([r"$\rho_{11}$", ρ11])
-        if ρ22:
-            ρ22 = abs(array(parfor(partial(uf.ρ, 2, 2), self.states)))
-            data.append([r"$\rho_{22}$", ρ22])
-        if ρ12:
-            ρ12 = array(parfor(partial(uf.ρ, 1, 2), self.states))
-            data.append([r"$Re(\rho_{12})$", real(ρ12)])
-            data.append([r"$Im(\rho_{12})$", imag(ρ12)])
+        try:
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                # Every chunk after the first restarts from the last time
+                # of the one before, which is dropped from the output.
+                first = max(start - 1, 0)
+                skip = start - first
+                jobs = [(H, args, kets[:, g], weights[g], t_list[first:stop],
+                         e_ops, nsteps, keep_states) for g in groups]
+                if pool is None:
+                    results = [evolve_kets(*job) for job in jobs]
+                else:
+                    results = [f.result() for f in
+                               [pool.submit(evolve_kets, *job)
+                                for job in jobs]]
 
-        return data
+                expect = sum(r[0] for r in results)[:, skip:]
+                chunk = [real(expect[0]), real(expect[1]), expect[2]]
+                chunk += [real(e) for e in expect[3:]]
+                states = []
+                if keep_states:
+                    states = [Qobj(ρ, dims=init_state.dims) for ρ in
+                              sum(array(r[1]) for r in results)[skip:]]
+                for g, r in zip(groups, results):
+                    kets[:, g] = r[2]
+                final = Qobj((kets * weights) @ kets.conj().T,
+                             dims=init_state.dims)
+                yield start, stop, chunk, states, final
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _static_chunks(self, H, args, c_ops, init_state, t_list, bounds,
+                       e_ops, keep_states, M, ν, method):
+        '''
+        Same as _ode_chunks, but evolving with the time independent
+        rotating frame Hamiltonian, either by stepping through the time
+        grid with its propagator (method "propagator") or by jumping
+        straight to every time with its eigenmodes ("floquet"), or with
+        those of its uncoupled blocks ("blocks"). The results are
+        transformed back to the interaction picture mesolve works in.
+        '''
+        Δ = args["delta"]
+        H_rot = rotating_frame_hamiltonian(H, args, M, Δ, ν)
+        # Diagonal of the free Hamiltonian, for undoing the rotation
+        h0 = real(free_hamiltonian(M, Δ, ν).diag())
+
+        def rotation(t):
+            return exp(1j * (h0[:, None] - h0[None, :]) * t)
+
+        # Go to the rotating frame at the time init_state is at
+        t0 = t_list[max(bounds[0] - 1, 0)]
+        ρ0 = Qobj(init_state.full() * rotation(t0).conj(),
+                  dims=init_state.dims)
+        skip = 0
+        evolved = None
+        t_chunks = [t_list[a:b] - t0 for a, b in zip(bounds[:-1], bounds[1:])]
+        if method == "blocks":
+            blocks = find_blocks(H_rot, c_ops)
+            try:
+                if blocks is None:
+                    raise ValueError("no block structure")
+                evolved = block_evolve(H_rot, c_ops, ρ0, blocks, t_chunks,
+                                       e_ops, keep_states)
+            except (ValueError, LinAlgError) as e:
+                warnings.warn("Can't evolve the blocks separately ({}), "
+                              "using the whole system's eigenmodes "
+                              "instead".format(e))
+                method = "floquet"
+        if method == "floquet":
+            try:
+                evolved = floquet_evolve(H_rot, c_ops, ρ0, t_chunks, e_ops,
+                                         keep_states)
+            except LinAlgError:
+                warnings.warn("Liouvillian eigenmodes are ill conditioned, "
+                              "stepping with the propagator instead")
+        if evolved is None:
+            dt = t_list[1] - t_list[0] if len(t_list) > 1 else 0
+            counts = bounds[1:] - bounds[:-1]
+            # Stepping starts at t0, which isn't part of the output
+            # unless it's the very first time.
+            skip = 1 if bounds[0] > 0 else 0
+            counts[0] += skip
+            evolved = propagate(H_rot, c_ops, ρ0, dt, counts, e_ops,
+                                keep_states)
+
+        for start, stop, (expect, rotated, last) in zip(bounds[:-1],
+                                                        bounds[1:], evolved):
+            expect = expect[:, skip:]
+            rotated = rotated[skip:]
+            skip = 0
+            t = t_list[start:stop]
+            # The populations don't care about the frame, ρ12 picks up
+            # the electronic phase.
+            chunk = [real(expect[0]), real(expect[1]),
+                     expect[2] * exp(-1j * Δ * t)]
+            chunk += [real(e) for e in expect[3:]]
+            states = [Qobj(ρ * rotation(tk), dims=init_state.dims)
+                      for tk, ρ in zip(t, rotated)]
+            final = Qobj(last * rotation(t[-1]), dims=init_state.dims)
+            yield start, stop, chunk, states, final
 
     def run_monte_carlo(self, **kwargs):
+        '''
+        Run trajectories in batches until the target error or the
+        maximum number of trajectories is reached.
+        '''
+        return self._monte_carlo(None, kwargs.get("target error", 0),
+                                 int(kwargs.get("max trajectories", 500)),
+                                 **kwargs)
+
+    def refine_monte_carlo(self, statistics, **kwargs):
+        '''
+        Add 'refine trajectories' more trajectories to the statistics of
+        an earlier run with the same parameters, so only the extra
+        trajectories need computing.
+        '''
+        extra = int(kwargs.get("refine trajectories", 256))
+        return self._monte_carlo(statistics, 0, statistics.ntraj + extra,
+                                 **kwargs)
+
+    def _monte_carlo(self, stats, target, max_traj, **kwargs):
 
         try:
             γ2 = sqrt(1 / (kwargs["lifetime"] * 1e6))
@@ -193,18 +1236,17 @@ class RabiFlopNumerical(BaseSimulation):
             γ12 = sqrt(1 / kwargs["dephasing time"])
         except ZeroDivisionError:
             γ12 = 0
-        if γ2 == 0 and γ12 == 0:
-            return [[], ["", []]]
         nbar = kwargs["nbar"]
         nsteps = kwargs["number of steps"]
-        res = kwargs["resolution"]
+        res = int(kwargs["resolution"])
         duration = kwargs["duration"]
         init_state = kwargs["initial state"]
-        M = kwargs["motional dimension"]
+        M = int(kwargs["motional dimension"])
         ρ11 = kwargs["ρ11"]
         ρ22 = kwargs["ρ22"]
         ρ12 = kwargs["ρ12"]
 
+        load_qutip()
         c_ops = []
         if γ2 != 0:
             T1 = tensor(sqrt(γ2) * sigmap(), qeye(M))  # Spontaneous emission
@@ -216,7 +1258,9 @@ class RabiFlopNumerical(BaseSimulation):
         t_list = linspace(0, duration, res)
 
         if nbar >= M:
-                nbar = M - 1
+            warnings.warn("nbar = {} doesn't fit in a motional dimension of "
+                          "{}, using nbar = {}".format(nbar, M, M - 1))
+            nbar = M - 1
 
         if init_state == "ground":
             init_state = tensor(basis(2, 0), basis(M, nbar))
@@ -225,26 +1269,49 @@ class RabiFlopNumerical(BaseSimulation):
 
         H, args = self.Hamiltonian(**kwargs)
 
-        expect = [tensor(basis(2, 0) * basis(2, 0).dag(), qeye(M)),
-                  tensor(basis(2, 1) * basis(2, 1).dag(), qeye(M)),
-                  tensor(basis(2, 0) * basis(2, 1).dag(), qeye(M))]
+        if not c_ops:
+            # Without jumps every trajectory is the same, so the initial
+            # ket only needs evolving once and there's no error to report.
+            expect, _, _ = evolve_kets(H, args, init_state.full(),
+                                       array([1.]), t_list,
+                                       electronic_e_ops(M), nsteps)
+            self.states = [t_list, list(expect)]
+            self.statistics = None
+            return electronic_data(t_list, expect, ρ11, ρ22, ρ12,
+                                   errors=zeros((4, res)))
 
-        output = mcsolve(H, init_state, t_list, c_ops, expect, args=args,
-                         options=Options(nsteps=nsteps),
-                         progress_bar=ui.TextProgressBar())
+        # Trajectories are run in batches (each spread over all cores by
+        # mcsolve) until the standard error of every plotted ρ element is
+        # below the target, or we run out of trajectories.
+        batch = int(kwargs.get("batch size", 64))
+        observed = [i for i, on in enumerate([ρ11, ρ22, ρ12, ρ12]) if on]
 
-        states = output.expect
-        self.states = [t_list, states]
+        if stats is None:
+            stats = TrajectoryStatistics(4, res)
+        while stats.ntraj < max_traj:
+            ntraj = min(batch, max_traj - stats.ntraj)
+            seeds = new_seeds(ntraj, stats.seeds)
+            output = mcsolve(H, init_state, t_list, c_ops,
+                             electronic_e_ops(M), args=args, ntraj=ntraj,
+                             options=Options(nsteps=nsteps, seeds=seeds,
+                                             average_expect=False),
+                             progress_bar=None)
+            stats.add(trajectory_samples(output.expect), seeds)
 
-        data = [t_list]
-        if ρ11:
-            data.append([r"$\rho_{11}$", states[0]])
-        if ρ22:
-            data.append([r"$\rho_{22}$", states[1]])
-        if ρ12:
-            data.append([r"$Re(\rho_{12})$", real(states[2])])
-            data.append([r"$Im(\rho_{12})$", imag(states[2])])
+            error = stats.stderr()[observed].max() if observed else 0
+            if target > 0 and error <= target:
+                break
+
+        mean = stats.mean()
+        states = [mean[0], mean[1], mean[2] + 1j * mean[3]]
+        self.states = [t_list, states]
+        self.statistics = stats
 
+        data = electronic_data(t_list, states, ρ11, ρ22, ρ12,
+                               errors=stats.stderr())
+        # Report the number of trajectories in the legend
+        for d in data[1:]:
+            d[0] += ", {} traj.".format(stats.ntraj)
         return data
 
 
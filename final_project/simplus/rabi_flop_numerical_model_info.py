@@ -2,7 +2,7 @@ model_info = ("This simulation numerically computes the dynamics for the followi
 r"$H = \frac{\Omega}{2} \sigma_+$"
 r"$\textrm{exp}\bigg\{i\eta \bigg(ae^{-i\nu t} + a^{\dagger}e^{i\nu t}\bigg)\bigg\} e^{i(\phi-\delta t)}$"
 r"$+\textrm{h.c.}$"
-"\nup to 3rd order in " + r"$\eta$."
+"\nup to 3rd order in " + r"$\eta$" + ", or exactly with the sidebands truncated at a given order."
 "\nAdditionally, finite lifetime and Markovian dephasing is included via the following Lindbladian:\n"
 r"$L=\gamma_{12}\bigg[\sigma_z\rho\sigma_z - \rho\bigg]$" 
 r"$+ \frac{\gamma_2}{2} \bigg[2\sigma_+\rho\sigma_- -\rho\sigma_-\sigma_+ - \sigma_-\sigma_+\rho\bigg]$"
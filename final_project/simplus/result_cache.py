@@ -0,0 +1,162 @@
+'''
+On-disk cache of simulation results.
+
+Results are stored as compressed npz files named after a hash of the model,
+the solver, the full set of parameters and the source code of the model's
+module and of every simplus module it imports, directly or not, so editing
+a model or anything it runs on invalidates its old results. Whatever else the
+run left on the model (its run details, e.g. the state history) is stored
+with the data, so a hit can restore it. The cache is shared
+by the GUI, sweeps and batch runs. Once it grows past 'max_bytes' the least
+recently used results are deleted.
+'''
+import os
+import ast
+import json
+import inspect
+import hashlib
+from io import BytesIO
+from numpy import savez_compressed, load as load_npz
+from result_io import pack, unpack
+from cache import atomic_write
+
+cache_dir = os.environ.get("SIMPLUS_RESULT_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".simplus",
+                                        "results"))
+max_bytes = int(os.environ.get("SIMPLUS_RESULT_CACHE_BYTES", 2**30))
+
+# Bump this if the stored format changes
+FORMAT_VERSION = 2
+
+_code_versions = {}
+
+
+def local_imports(path):
+    '''
+    The source files of the module at path and of all the modules next to
+    it that it imports, directly or through each other, including imports
+    inside functions.
+    '''
+    folder = os.path.dirname(path)
+    found = []
+    todo = [path]
+    while todo:
+        path = todo.pop()
+        if path in found:
+            continue
+        found.append(path)
+        with open(path, "rb") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                local = os.path.join(folder, name.split(".")[0] + ".py")
+                if os.path.isfile(local):
+                    todo.append(local)
+    return sorted(found)
+
+
+def code_version(cls):
+    '''Hash of the source of the module defining cls and of the simplus
+    modules it depends on.'''
+    module = cls.__module__
+    if module not in _code_versions:
+        sha = hashlib.sha1()
+        try:
+            paths = local_imports(inspect.getsourcefile(cls))
+        except (OSError, TypeError):
+            paths = []
+        for path in paths:
+            with open(path, "rb") as f:
+                sha.update(os.path.basename(path).encode() + b"\0")
+                sha.update(f.read())
+        _code_versions[module] = sha.hexdigest()
+    return _code_versions[module]
+
+
+def result_key(model, solver, settings):
+    '''
+    Stable hash identifying a run, or None if the settings can't be
+    hashed (e.g. they hold objects rather than plain values).
+    '''
+    cls = type(model)
+    try:
+        description = json.dumps({"model": cls.__module__ + "." +
+                                  cls.__name__,
+                                  "solver": solver,
+                                  "settings": settings,
+                                  "code": code_version(cls),
+                                  "format": FORMAT_VERSION},
+                                 sort_keys=True)
+    except TypeError:
+        return None
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def _path(key):
+    return os.path.join(cache_dir, key + ".npz")
+
+
+DETAIL_PREFIX = "detail_"
+
+
+def load(key):
+    '''
+    Returns the cached (data, details) for key, where details is the dict
+    of arrays stored along with the data, or None on a miss.
+    '''
+    path = _path(key)
+    try:
+        with load_npz(path, allow_pickle=False) as f:
+            meta = json.loads(str(f["meta"]))
+            arrays = {name: f[name] for name in f.files}
+            data = unpack(meta, arrays)
+    except (OSError, KeyError, ValueError):
+        return None
+    details = {name[len(DETAIL_PREFIX):]: a for name, a in arrays.items()
+               if name.startswith(DETAIL_PREFIX)}
+    # Mark as recently used
+    os.utime(path)
+    return data, details
+
+
+def store(key, data, details=None):
+    '''Store data, and optionally a dict of detail arrays, under key.'''
+    os.makedirs(cache_dir, exist_ok=True)
+    meta, arrays = pack(data)
+    for name, a in (details or {}).items():
+        arrays[DETAIL_PREFIX + name] = a
+    buf = BytesIO()
+    savez_compressed(buf, meta=json.dumps(meta), **arrays)
+    atomic_write(_path(key), buf.getvalue())
+    evict()
+
+
+def evict():
+    '''Delete least recently used results until under max_bytes.'''
+    entries = []
+    for name in os.listdir(cache_dir):
+        # Files still being written end in .tmp
+        if not name.endswith(".npz"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
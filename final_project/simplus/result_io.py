@@ -0,0 +1,138 @@
+'''
+Conversion between simulation data and plain named arrays, and the
+.simplus file format built on top of it.
+
+Simulation data is a list [t_list, [label, values, ...], ...]. Every trace
+holds a label, its values and optionally error bars (another array) or,
+for 2D traces, a [label, values] pair for the y axis. pack() splits this
+into a JSON serializable description and a dict of numpy arrays, which
+is what the file formats store. unpack() puts it back together.
+
+A .simplus file is a magic string, the length of a JSON header, the header
+itself (parameters, trace description and the dtype, shape and offset of
+every array) and then the raw arrays, each aligned to 64 bytes. Loading
+memory maps the arrays, so only the parts that are actually used are
+read from disk, and nothing in the file is ever unpickled.
+'''
+import json
+import struct
+from numpy import asarray, ascontiguousarray, dtype, empty, memmap
+
+
+def pack(data):
+    '''Returns (meta, arrays) for simulation data.'''
+    arrays = {"t": asarray(data[0])}
+    traces = []
+    for i, trace in enumerate(data[1:]):
+        parts = []
+        for j, part in enumerate(trace[1:], 1):
+            name = "trace_{}_{}".format(i, j)
+            if type(part) in [list, tuple]:
+                # An axis: [label, values]
+                arrays[name] = asarray(part[1])
+                parts.append({"array": name, "label": part[0]})
+            else:
+                arrays[name] = asarray(part)
+                parts.append({"array": name})
+        traces.append({"label": trace[0], "parts": parts})
+    return {"traces": traces}, arrays
+
+
+def unpack(meta, arrays, only=None):
+    '''
+    Rebuild simulation data from pack() output. 'arrays' can be anything
+    indexable by name, e.g. an open npz file. If 'only' is given, just
+    the traces with those labels are read.
+    '''
+    data = [arrays["t"]]
+    for trace in meta["traces"]:
+        if only is not None and trace["label"] not in only:
+            continue
+        d = [trace["label"]]
+        for part in trace["parts"]:
+            if "label" in part:
+                d.append([part["label"], arrays[part["array"]]])
+            else:
+                d.append(arrays[part["array"]])
+        data.append(d)
+    return data
+
+
+MAGIC = b"SIMPLUS\x01"
+ALIGN = 64
+
+
+def save(path, data, params=None, states=None):
+    '''
+    Write simulation data, the parameters it was run with and, optionally,
+    the state history to a .simplus file.
+    '''
+    meta, arrays = pack(data)
+    if states is not None:
+        arrays["states"] = asarray(states)
+
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        arrays[name] = a = ascontiguousarray(a)
+        layout[name] = {"dtype": a.dtype.str, "shape": list(a.shape),
+                        "offset": offset}
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({"params": params, "data": meta,
+                         "arrays": layout}).encode()
+    # Pad so the arrays start on an aligned offset
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        start = f.tell()
+        for name, a in arrays.items():
+            f.seek(start + layout[name]["offset"])
+            a.tofile(f)
+
+
+def read_header(path):
+    '''Returns the header of a .simplus file and where its arrays start.'''
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a simplus data file".format(path))
+        length, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length).decode())
+    return header, len(MAGIC) + 8 + length
+
+
+class _MappedArrays:
+    '''Memory maps the arrays of a .simplus file on demand.'''
+
+    def __init__(self, path, layout, start):
+        self.path = path
+        self.layout = layout
+        self.start = start
+
+    def __contains__(self, name):
+        return name in self.layout
+
+    def __getitem__(self, name):
+        info = self.layout[name]
+        shape = tuple(info["shape"])
+        if dtype(info["dtype"]).itemsize == 0 or 0 in shape:
+            # Empty arrays can't be memory mapped
+            return empty(shape, dtype=info["dtype"])
+        return memmap(self.path, dtype=info["dtype"], mode="r",
+                      offset=self.start + info["offset"], shape=shape)
+
+
+def load(path, only=None):
+    '''
+    Open a .simplus file, returning (params, data, states). The arrays are
+    memory mapped; if 'only' is given just those traces are included.
+    states is None unless the state history was saved.
+    '''
+    header, start = read_header(path)
+    arrays = _MappedArrays(path, header["arrays"], start)
+    data = unpack(header["data"], arrays, only)
+    states = arrays["states"] if "states" in arrays else None
+    return header["params"], data, states
@@ -177,6 +177,7 @@ class Ui_MainWindow(object):
         self.comboBox_EquationSolverType.setObjectName("comboBox_EquationSolverType")
         self.comboBox_EquationSolverType.addItem("")
         self.comboBox_EquationSolverType.addItem("")
+        self.comboBox_EquationSolverType.addItem("")
         self.verticalLayout.addWidget(self.comboBox_EquationSolverType)
         self.label_2 = QtWidgets.QLabel(self.scrollAreaWidgetContents_2)
         self.label_2.setEnabled(True)
@@ -294,6 +295,7 @@ class Ui_MainWindow(object):
         self.tabWidget_Numerical.setTabText(self.tabWidget_Numerical.indexOf(self.tab_6), _translate("MainWindow", "Model Information"))
         self.comboBox_EquationSolverType.setItemText(0, _translate("MainWindow", "Master Equation Solver"))
         self.comboBox_EquationSolverType.setItemText(1, _translate("MainWindow", "Quantum Jump Solver"))
+        self.comboBox_EquationSolverType.setItemText(2, _translate("MainWindow", "Auto"))
         self.label_2.setText(_translate("MainWindow", "Parameter Dictionary"))
         self.treeWidget_Numerical.setSortingEnabled(True)
         self.treeWidget_Numerical.headerItem().setText(0, _translate("MainWindow", "Parameters"))
@@ -308,7 +310,7 @@ class Ui_MainWindow(object):
         self.tabWidget_Main.setTabText(self.tabWidget_Main.indexOf(self.tab_2), _translate("MainWindow", "Numerical"))
         self.menuImport.setTitle(_translate("MainWindow", "Import"))
         self.menuCSV.setTitle(_translate("MainWindow", "CSV"))
-        self.menuPickle.setTitle(_translate("MainWindow", "pickle"))
+        self.menuPickle.setTitle(_translate("MainWindow", "Simulation data"))
         self.menuFile.setTitle(_translate("MainWindow", "File"))
         self.menuSave.setTitle(_translate("MainWindow", "Save"))
         self.actionBrowse.setText(_translate("MainWindow", "browse data..."))
@@ -0,0 +1,140 @@
+'''
+Runs simulations away from the Qt event loop so the GUI stays responsive.
+
+The simulation itself runs in a separate process, which streams its data
+back chunk by chunk through a queue. A QThread watches the queue and turns
+what comes back into Qt signals. Cancelling kills the process, so the
+integrator really stops rather than finishing the current chunk.
+
+The process isn't a daemon, since solvers start process pools of their
+own (e.g. mcsolve's trajectories), which daemons aren't allowed to do. It
+leads its own process group instead, so cancelling can take the pools'
+workers down with it.
+'''
+import os
+import signal
+import warnings
+import traceback
+import multiprocessing
+from queue import Empty
+from importlib import import_module
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+def _stream_in_process(module_name, class_name, solver, params, queue):
+    '''Process target: stream the simulation data into the queue.'''
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    try:
+        model = getattr(import_module(module_name), class_name)()
+        if solver == "run_auto":
+            solver, reason = model.choose_solver(**params)
+            queue.put(("note", "Using {}: {}".format(solver, reason)))
+        with warnings.catch_warnings(record=True) as caught:
+            for chunk in model.stream(solver, **params):
+                queue.put(("chunk", chunk))
+        # Pass on warnings (e.g. about the truncation) to the status bar
+        for w in caught:
+            queue.put(("note", str(w.message)))
+        states = model.state_history(**params)
+        if states is not None:
+            queue.put(("states", states))
+        # Monte Carlo runs keep their trajectory statistics so they can
+        # be refined later
+        queue.put(("done", getattr(model, "statistics", None)))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+class SimulationWorker(QThread):
+    '''
+    Run 'solver' of the model class_name in module_name with params.
+    'chunk' is emitted for every piece of streamed data, 'progress' with
+    the percentage of expected chunks received so far, 'note' with the
+    solver picked and why when solver is "run_auto" and with any warnings
+    the run raised, 'states' with the state history array when "state
+    history" is "full", then either 'completed' with the list of all
+    chunks and the model's trajectory statistics (None if it has none),
+    'failed' with a traceback or 'cancelled'.
+    '''
+    chunk = pyqtSignal(object)
+    progress = pyqtSignal(int)
+    note = pyqtSignal(str)
+    states = pyqtSignal(object)
+    completed = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, module_name, class_name, solver, params, parent=None):
+        super(SimulationWorker, self).__init__(parent)
+        self.module_name = module_name
+        self.class_name = class_name
+        self.solver = solver
+        self.params = params
+        self.expected_chunks = max(1, int(params.get("stream chunks", 1)))
+        self._cancelled = False
+        self._process = None
+
+    def run(self):
+        queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_stream_in_process,
+            args=(self.module_name, self.class_name, self.solver,
+                  self.params, queue))
+        self._process.start()
+
+        chunks = []
+        while not self._cancelled:
+            try:
+                kind, payload = queue.get(timeout=0.1)
+            except Empty:
+                if self._cancelled:
+                    break
+                if not self._process.is_alive() and queue.empty():
+                    self._process.join()
+                    self.failed.emit("The simulation process died "
+                                     "unexpectedly.")
+                    return
+                continue
+
+            if kind == "chunk":
+                chunks.append(payload)
+                self.chunk.emit(payload)
+                self.progress.emit(min(100, 100 * len(chunks) //
+                                       self.expected_chunks))
+            elif kind == "note":
+                self.note.emit(payload)
+            elif kind == "states":
+                self.states.emit(payload)
+            elif kind == "done":
+                self._process.join()
+                self.progress.emit(100)
+                self.completed.emit(chunks, payload)
+                return
+            else:
+                self._process.join()
+                self.failed.emit(payload)
+                return
+
+        self._stop_process()
+        self.cancelled.emit()
+
+    def cancel(self):
+        '''Stop the simulation process straight away.'''
+        self._cancelled = True
+        self._stop_process()
+
+    def _stop_process(self):
+        '''Kill the simulation process, and any it started, and wait for
+        it to go.'''
+        process = self._process
+        if process is None:
+            return
+        if process.is_alive():
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except (AttributeError, ProcessLookupError):
+                # No process groups here, or the process hasn't made its
+                # own yet
+                process.terminate()
+        process.join()
@@ -0,0 +1,32 @@
+import os
+import sys
+import pytest
+
+# simplus modules import each other by their plain names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+@pytest.fixture(scope="session")
+def app():
+    from PyQt5.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture(autouse=True)
+def cache_dirs(tmp_path, monkeypatch):
+    '''
+    Keep every test's cached results, compiled coefficients and TeX
+    renders to itself, rather than in ~/.simplus.
+    '''
+    import coeff_cache
+    import result_cache
+    import tex_render
+    for module, name, env in [(result_cache, "results",
+                               "SIMPLUS_RESULT_CACHE"),
+                              (coeff_cache, "coeff_cache",
+                               "SIMPLUS_COEFF_CACHE"),
+                              (tex_render, "tex_cache", "SIMPLUS_TEX_CACHE")]:
+        cache_dir = str(tmp_path / name)
+        monkeypatch.setenv(env, cache_dir)
+        monkeypatch.setattr(module, "cache_dir", cache_dir)
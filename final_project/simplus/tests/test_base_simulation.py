@@ -0,0 +1,46 @@
+from numpy import arange
+from numpy.testing import assert_array_equal
+from base_simulation import join_chunks
+from ms_numerical import MSNumerical
+from rabi_flop_analytic import RabiFlopAnalytic
+
+
+def test_join_chunks_concatenates_along_t():
+    chunks = [[arange(3), ["a", arange(3), arange(3) / 10]],
+              [arange(3, 5), ["a, done", arange(3, 5), arange(3, 5) / 10]]]
+    t, (label, values, errors) = join_chunks(chunks)
+    assert_array_equal(t, arange(5))
+    assert_array_equal(values, arange(5))
+    assert_array_equal(errors, arange(5) / 10)
+    assert label == "a, done"
+
+
+def test_join_chunks_keeps_axes():
+    axis = ["Δ", arange(4)]
+    chunks = [[arange(2), ["P", arange(8).reshape(4, 2), axis]],
+              [arange(2, 3), ["P", arange(4).reshape(4, 1), axis]]]
+    t, (label, values, (ylabel, y)) = join_chunks(chunks)
+    assert values.shape == (4, 3)
+    assert ylabel == "Δ"
+    assert_array_equal(y, arange(4))
+
+
+def test_placeholder_models_stream():
+    model = MSNumerical()
+    for solver in ["run_master_equation", "run_monte_carlo"]:
+        chunks = list(model.stream(solver, **model.default_settings()))
+        assert_array_equal(join_chunks(chunks)[0], [0])
+    # and again from the result cache
+    chunks = list(model.stream("run_master_equation",
+                               **model.default_settings()))
+    assert_array_equal(join_chunks(chunks)[0], [0])
+
+
+def test_chevron_streams():
+    model = RabiFlopAnalytic()
+    params = dict(model.default_settings(),
+                  **{"scan Δ": True, "Δ points": 5, "resolution": 7})
+    for _ in range(2):
+        data, = model.stream("run", **params)
+        assert data[1][1].shape == (5, 7)
+        assert len(data[1][2][1]) == 5
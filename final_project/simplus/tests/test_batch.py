@@ -0,0 +1,14 @@
+import pytest
+from batch import job_settings
+from rabi_flop_numerical import RabiFlopNumerical
+
+
+def test_job_settings_checks_ranges():
+    model = RabiFlopNumerical()
+    assert job_settings(model, {"duration": 5})["duration"] == 5
+    with pytest.raises(ValueError):
+        job_settings(model, {"duration": 10**6})
+    with pytest.raises(ValueError):
+        job_settings(model, {"duration": "abc"})
+    with pytest.raises(KeyError):
+        job_settings(model, {"not a parameter": 1})
@@ -0,0 +1,47 @@
+from numpy import concatenate
+from numpy.testing import assert_array_equal, assert_allclose
+
+from csv_loader import iter_csv_chunks, read_csv, load_overlay
+
+
+def write(tmp_path, content):
+    path = tmp_path / "data.csv"
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_trailing_blank_lines(tmp_path):
+    path = write(tmp_path, b"1,2\n3,4\n\n")
+    assert_array_equal(read_csv(path), [[1, 3], [2, 4]])
+
+
+def test_whitespace_only_lines(tmp_path):
+    path = write(tmp_path, b"1,2\n  \n3,4\n\t\n")
+    assert_array_equal(read_csv(path), [[1, 3], [2, 4]])
+
+
+def test_crlf(tmp_path):
+    path = write(tmp_path, b"t,p\r\n1,0.5\r\n2,0.25\r\n\r\n")
+    assert_array_equal(read_csv(path), [[1, 2], [0.5, 0.25]])
+
+
+def test_lines_split_across_blocks(tmp_path):
+    path = write(tmp_path, b"".join(b"%d,%d\n\n" % (i, i % 2)
+                                    for i in range(100)))
+    rows = concatenate(list(iter_csv_chunks(path, block_bytes=7)))
+    assert_array_equal(rows[:, 0], range(100))
+    assert_array_equal(rows[:, 1], [i % 2 for i in range(100)])
+
+
+def test_header_only(tmp_path):
+    path = write(tmp_path, b"t,p\n")
+    assert read_csv(path).size == 0
+    assert load_overlay(path).size == 0
+
+
+def test_shot_data_is_aggregated(tmp_path):
+    path = write(tmp_path, b"time,outcome\n1,0\n1,1\n2,1\n2,1\n\n")
+    t, p, err = load_overlay(path)
+    assert_array_equal(t, [1, 2])
+    assert_array_equal(p, [0.5, 1])
+    assert_allclose(err, [0.5 / 2 ** 0.5, 0])
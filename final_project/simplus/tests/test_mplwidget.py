@@ -0,0 +1,23 @@
+from numpy import linspace, sin
+from mplwidget import MplWidgetAnalytic, MplWidgetNumerical
+
+
+def test_scalar_data_is_plotted_as_a_point(app):
+    # What models with nothing to simulate yet (e.g. Molmer Sorensen)
+    # return
+    for widget in [MplWidgetNumerical(), MplWidgetAnalytic()]:
+        widget.update_figure([0, ["", 0]])
+        assert len(widget.traces) == 1
+        assert list(widget.traces[0].t) == [0]
+        widget.extend_figure([1, ["", 0]])
+        assert list(widget.traces[0].t) == [0, 1]
+
+
+def test_streamed_chunks_extend_the_traces(app):
+    widget = MplWidgetNumerical()
+    t = linspace(0, 1, 100)
+    widget.update_figure([t[:50], ["a", sin(t[:50])]], xlim=(0, 1))
+    widget.extend_figure([t[50:], ["a, done", sin(t[50:])]])
+    trace, = widget.traces
+    assert len(trace.t) == 100
+    assert trace.label == "a, done"
@@ -0,0 +1,48 @@
+import os
+import inspect
+from numpy.testing import assert_allclose
+import result_cache
+from rabi_flop_numerical import RabiFlopNumerical
+
+
+def settings(**changes):
+    params = RabiFlopNumerical().default_settings()
+    params.update({"resolution": 5, "motional dimension": 4})
+    params.update(changes)
+    return params
+
+
+def test_cache_hit_restores_full_states_and_truncation():
+    params = settings(**{"state history": "full", "truncation": "auto"})
+    computed = RabiFlopNumerical()
+    data = computed.run_cached("run_master_equation", **params)
+
+    cached = RabiFlopNumerical()
+    assert_allclose(cached.run_cached("run_master_equation", **params)[1][1],
+                    data[1][1])
+    assert cached.truncation == computed.truncation
+    assert len(cached.states) == len(computed.states)
+    for ρ, expected in zip(cached.states, computed.states):
+        assert ρ.dims == expected.dims
+        assert_allclose(ρ.full(), expected.full())
+
+
+def test_cache_hit_replaces_the_last_runs_states():
+    model = RabiFlopNumerical()
+    reduced = settings()
+    model.run_cached("run_master_equation", **reduced)
+    expected = model.states
+
+    model.run_cached("run_master_equation",
+                     **settings(**{"state history": "none"}))
+    assert len(model.states) == 0
+    list(model.stream("run_master_equation", **reduced))
+    assert_allclose(model.states, expected)
+
+
+def test_code_version_covers_the_modules_the_model_uses():
+    path = inspect.getsourcefile(RabiFlopNumerical)
+    names = [os.path.basename(p) for p in result_cache.local_imports(path)]
+    for name in ["rabi_flop_numerical.py", "base_simulation.py",
+                 "trajectory_stats.py", "coeff_cache.py"]:
+        assert name in names
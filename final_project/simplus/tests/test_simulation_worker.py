@@ -0,0 +1,66 @@
+import sys
+from simulation_worker import SimulationWorker
+from rabi_flop_numerical import RabiFlopNumerical
+
+
+def run_worker(solver, params):
+    worker = SimulationWorker("rabi_flop_numerical", "RabiFlopNumerical",
+                              solver, params)
+    result = {}
+    worker.completed.connect(lambda chunks, stats: result.update(
+        chunks=chunks, statistics=stats))
+    worker.failed.connect(lambda message: result.update(failed=message))
+    worker.states.connect(lambda states: result.update(states=states))
+    worker.note.connect(lambda note: result.setdefault("notes", []).append(
+        note))
+    # Run in this thread, so the signals arrive before run returns
+    worker.run()
+    return result
+
+
+def test_monte_carlo_with_parallel_trajectories(app, monkeypatch):
+    # mcsolve spreads the trajectories over a process pool, which the
+    # simulation process has to be allowed to start
+    monkeypatch.setenv("QUTIP_NUM_PROCESSES", "4")
+    if "qutip" in sys.modules:
+        monkeypatch.setattr(sys.modules["qutip"].settings, "num_cpus", 4)
+    params = RabiFlopNumerical().default_settings()
+    params.update({"dephasing time": 2, "resolution": 20,
+                   "max trajectories": 16, "batch size": 8})
+
+    result = run_worker("run_monte_carlo", params)
+
+    assert "failed" not in result, result.get("failed")
+    assert result["statistics"].ntraj == 16
+    assert len(result["chunks"][0][0]) == 20
+
+
+def test_full_state_history_is_sent_back(app):
+    params = RabiFlopNumerical().default_settings()
+    params.update({"resolution": 5, "state history": "full",
+                   "motional dimension": 4, "stream chunks": 2})
+
+    result = run_worker("run_master_equation", params)
+
+    assert "failed" not in result, result.get("failed")
+    assert result["states"].shape == (5, 8, 8)
+
+
+def test_reduced_state_history_is_not_sent(app):
+    params = RabiFlopNumerical().default_settings()
+    params.update({"resolution": 5, "motional dimension": 4})
+
+    result = run_worker("run_master_equation", params)
+
+    assert "failed" not in result, result.get("failed")
+    assert "states" not in result
+
+
+def test_truncation_warnings_become_notes(app):
+    params = RabiFlopNumerical().default_settings()
+    params.update({"resolution": 5, "motional dimension": 3, "nbar": 5})
+
+    result = run_worker("run_master_equation", params)
+
+    assert "failed" not in result, result.get("failed")
+    assert any("doesn't fit" in note for note in result["notes"])
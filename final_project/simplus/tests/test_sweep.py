@@ -0,0 +1,30 @@
+from rabi_flop_analytic import RabiFlopAnalytic
+from rabi_flop_numerical import RabiFlopNumerical
+
+
+def test_sweep_stacks_values():
+    result = RabiFlopAnalytic().sweep("run", [("Ω", [0.5, 1, 2])],
+                                      processes=1, resolution=7)
+    t, (label, values) = result.data
+    assert len(t) == 7
+    assert values.shape == (3, 7)
+    assert result.axes[0][0] == "Ω"
+
+
+def test_sweep_keeps_the_axis_of_2d_traces():
+    result = RabiFlopAnalytic().sweep(
+        "run", [("Ω", [0.5, 1])], processes=1, resolution=7,
+        **{"scan Δ": True, "Δ points": 5})
+    t, (label, values, (ylabel, Δ)) = result.data
+    assert values.shape == (2, 5, 7)
+    assert len(Δ) == 5
+
+
+def test_sweep_stacks_monte_carlo_error_bars():
+    result = RabiFlopNumerical().sweep(
+        "run_monte_carlo", [("Ω", [0.5, 1])], processes=1,
+        **{"dephasing time": 2, "resolution": 6, "motional dimension": 4,
+           "max trajectories": 4, "batch size": 4})
+    t, (label, values, errors) = result.data
+    assert values.shape == errors.shape == (2, 6)
+    assert (errors >= 0).all()
@@ -0,0 +1,92 @@
+'''
+The rotating frame time stepping modes ("propagator", "floquet" and
+"blocks") against mesolve integrating the interaction picture Hamiltonian
+with tight tolerances.
+'''
+import warnings
+import pytest
+from numpy import sqrt, real, imag, linspace
+from qutip import (Options, basis, mesolve, qeye, sigmap, sigmaz, tensor,
+                   thermal_dm)
+from rabi_flop_numerical import RabiFlopNumerical, electronic_e_ops
+
+BASE = {"ρ11": True, "ρ22": True, "ρ12": True, "resolution": 40,
+        "duration": 3, "stream chunks": 2, "motional dimension": 6,
+        "nbar": 0.5, "Δ": 0.7, "phi": 0.4, "ν": 1.3, "η": 0.15}
+
+CASES = {
+    "carrier": {"order in η": "0"},
+    "first order": {"order in η": "1"},
+    "second order dephasing": {"order in η": "2", "dephasing time": 2},
+    "third order decay": {"order in η": "3", "lifetime": 1e-6},
+    "exact decay and dephasing": {"coupling": "exact", "sideband order": 2,
+                                  "lifetime": 3e-6, "dephasing time": 5},
+    "excited": {"initial state": "excited", "Δ": -1.0},
+}
+
+BLOCK_CASES = {
+    "carrier": {"order in η": "0"},
+    "carrier dephasing": {"order in η": "0", "dephasing time": 2},
+    "exact carrier decay": {"coupling": "exact", "sideband order": 0,
+                            "η": 0.4, "lifetime": 1e-6},
+    "resolved blue sideband": {
+        "order in η": "2", "Δ": 1.25,
+        "rotating wave approximation": "resolved sideband"},
+    "resolved red sideband dephasing": {
+        "order in η": "1", "Δ": -1.3, "dephasing time": 2,
+        "rotating wave approximation": "resolved sideband"},
+}
+
+
+def settings(case):
+    params = RabiFlopNumerical().default_settings()
+    params.update(BASE)
+    params.update(case)
+    return params
+
+
+def reference(params):
+    '''ρ11, ρ22 and ρ12 from mesolve.'''
+    model = RabiFlopNumerical()
+    M = params["motional dimension"]
+    H, args = model.Hamiltonian(**params)
+    # Written out the way the model sets up its collapse operators
+    c_ops = []
+    if params["lifetime"]:
+        γ2 = sqrt(1 / (params["lifetime"] * 1e6))
+        c_ops.append(tensor(sqrt(γ2) * sigmap(), qeye(M)))
+    if params["dephasing time"]:
+        γ12 = sqrt(1 / params["dephasing time"])
+        c_ops.append(tensor(sqrt(γ12) * sigmaz(), qeye(M)))
+    level = 0 if params["initial state"] == "ground" else 1
+    state = tensor(basis(2, level) * basis(2, level).dag(),
+                   thermal_dm(M, params["nbar"]))
+    t_list = linspace(0, params["duration"], params["resolution"])
+    output = mesolve(H, state, t_list, c_ops, electronic_e_ops(M),
+                     args=args, options=Options(atol=1e-12, rtol=1e-10,
+                                                nsteps=10**6))
+    ρ11, ρ22, ρ12 = output.expect
+    return [abs(real(ρ11)), abs(real(ρ22)), real(ρ12), imag(ρ12)]
+
+
+def check(params, stepping):
+    expected = reference(params)
+    params = dict(params, **{"time stepping": stepping})
+    with warnings.catch_warnings():
+        # Falling back to another mode would hide a broken one
+        warnings.filterwarnings("error", message=".* instead")
+        data = RabiFlopNumerical().run_master_equation(**params)
+    assert len(data) == 5
+    for (label, values), e in zip(data[1:], expected):
+        assert abs(values - e).max() < 1e-7, label
+
+
+@pytest.mark.parametrize("stepping", ["propagator", "floquet"])
+@pytest.mark.parametrize("case", CASES)
+def test_static_stepping_matches_mesolve(case, stepping):
+    check(settings(CASES[case]), stepping)
+
+
+@pytest.mark.parametrize("case", BLOCK_CASES)
+def test_blocks_match_mesolve(case):
+    check(settings(BLOCK_CASES[case]), "blocks")
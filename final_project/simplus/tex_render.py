@@ -0,0 +1,116 @@
+'''
+Rendering of TeX strings to images, cached by their source.
+
+Going through LaTeX means starting latex and dvipng, which takes a good
+fraction of a second, so rendered images are kept in memory and as PNG
+files in 'cache_dir', and every source is only ever run through LaTeX
+once. Without a LaTeX installation matplotlib's mathtext is used instead.
+
+Plot labels never go through LaTeX: mathtext handles them quickly and
+caches their layout itself. Labels mathtext can't parse are shown as
+plain text.
+'''
+import os
+import shutil
+import hashlib
+from io import BytesIO
+from functools import lru_cache
+import matplotlib as mpl
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.image import imread
+from matplotlib.mathtext import MathTextParser
+from cache import LRUCache, atomic_write
+
+cache_dir = os.environ.get("SIMPLUS_TEX_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".simplus",
+                                        "tex_cache"))
+
+# Enable use of amsmath latex package for model information
+PREAMBLE = r"\usepackage{amsmath}"
+
+_images = LRUCache(64 * 2**20, lambda image: image.nbytes)
+_mathtext = MathTextParser("path")
+
+
+@lru_cache(maxsize=None)
+def have_latex():
+    return (shutil.which("latex") is not None and
+            shutil.which("dvipng") is not None)
+
+
+def escape(text):
+    '''Make text show literally, i.e. without any math.'''
+    return text.replace("$", r"\$")
+
+
+def _draw(source, usetex, fontsize, dpi):
+    '''Render source with matplotlib, returning the PNG file contents.'''
+    fig = Figure(dpi=dpi)
+    FigureCanvasAgg(fig)
+    with mpl.rc_context({"text.usetex": usetex,
+                         "text.latex.preamble": PREAMBLE}):
+        fig.text(0, 0, source, fontsize=fontsize)
+        buf = BytesIO()
+        fig.savefig(buf, format="png", dpi=dpi, transparent=True,
+                    bbox_inches="tight", pad_inches=0.02)
+    return buf.getvalue()
+
+
+def _draw_any(source, fontsize, dpi):
+    '''Render with LaTeX if possible, falling back to mathtext.'''
+    if have_latex():
+        try:
+            return _draw(source, True, fontsize, dpi)
+        except (RuntimeError, ValueError):
+            # LaTeX choked on it, see if mathtext does any better
+            pass
+    try:
+        return _draw(source, False, fontsize, dpi)
+    except ValueError:
+        return _draw(escape(source), False, fontsize, dpi)
+
+
+def _png(source, fontsize, dpi):
+    '''PNG of the rendered source, from the disk cache if it's there.'''
+    key = hashlib.sha1(repr((source, fontsize, dpi, have_latex(),
+                             mpl.__version__)).encode()).hexdigest()
+    path = os.path.join(cache_dir, key + ".png")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    png = _draw_any(source, fontsize, dpi)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        atomic_write(path, png)
+    except OSError:
+        # Not being able to cache isn't a reason to fail
+        pass
+    return png
+
+
+def render(source, fontsize=None, dpi=100):
+    '''Returns source rendered as an RGBA image array.'''
+    if fontsize is None:
+        fontsize = mpl.rcParams["font.size"]
+    key = (source, fontsize, dpi)
+    return _images.get(key, lambda: imread(BytesIO(_png(*key)),
+                                           format="png"))
+
+
+@lru_cache(maxsize=1024)
+def plot_label(label):
+    '''
+    Returns label unchanged if mathtext can lay it out, otherwise escaped
+    so it's shown as plain text instead of failing the whole draw.
+    '''
+    if label.count("$") < 2:
+        return label
+    try:
+        _mathtext.parse(label, 72)
+    except ValueError:
+        return escape(label)
+    return label
@@ -0,0 +1,37 @@
+'''Running statistics for averaging quantum trajectories.'''
+from numpy import zeros, sqrt, maximum, asarray
+
+
+class TrajectoryStatistics:
+    '''
+    Keeps per-time sums and sums of squares of real valued trajectory
+    samples, along with the number of trajectories and the random seeds
+    they were run with. That's all that's needed for the mean and the
+    standard error, so more trajectories can be merged in at any time.
+    '''
+
+    def __init__(self, nobs, res):
+        self.ntraj = 0
+        self.sum = zeros((nobs, res))
+        self.sum_sq = zeros((nobs, res))
+        self.seeds = []
+
+    def add(self, samples, seeds):
+        '''Merge in samples of shape (ntraj, nobs, res).'''
+        samples = asarray(samples)
+        self.ntraj += samples.shape[0]
+        self.sum += samples.sum(axis=0)
+        self.sum_sq += (samples**2).sum(axis=0)
+        self.seeds += list(seeds)
+
+    def mean(self):
+        return self.sum / max(self.ntraj, 1)
+
+    def stderr(self):
+        '''Standard error of the mean, using the unbiased variance.'''
+        if self.ntraj < 2:
+            return self.sum * 0 + float("inf")
+        mean = self.mean()
+        var = (self.sum_sq - self.ntraj * mean**2) / (self.ntraj - 1)
+        # Rounding can push the variance slightly negative
+        return sqrt(maximum(var, 0) / self.ntraj)
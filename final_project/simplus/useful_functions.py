@@ -1,9 +1,10 @@
 '''A place to put commonly used functions.'''
-from qutip import *
 from numpy import sqrt
 
 
 def ρ(i, j, state, half_rotation=False):
+    # qutip is slow to import, so only bring it in when it's needed
+    from qutip import qeye, sigmay, tensor
     i -= 1
     j -= 1
     n = state.dims[0].count(2)